@@ -43,7 +43,6 @@ from matplotlib import cm
 from docopt import docopt
 import pandas as pd
 import numpy as np
-import pysam as ps
 import glob
 import copy
 from Bio import SeqIO
@@ -158,12 +157,15 @@ class Digest(AbstractCommand):
 
     usage:
         digest [--plot] [--figdir=FILE] [--force] [--circular] [--size=INT]
-               [--outdir=DIR] --enzyme=ENZ <fasta>
+               [--outdir=DIR] [--threads=INT] [--cache] --enzyme=ENZ <fasta>
 
     arguments:
         fasta                     Fasta file to be digested
 
     options:
+        --cache                         Reuse restriction sites from, and save
+                                        them to, a cache in the user cache
+                                        directory (~/.cache/hicstuff).
         -c, --circular                  Specify if the genome is circular.
         -e, --enzyme=ENZ[,ENZ2,...]     A restriction enzyme or an integer
                                         representing fixed chunk sizes (in bp).
@@ -172,6 +174,8 @@ class Digest(AbstractCommand):
         -F, --force                     Write even if the output file already exists.
         -s, --size=INT                  Minimum size threshold to keep
                                         fragments. [default: 0]
+        -t, --threads=INT               Number of processes used to digest
+                                        contigs in parallel. [default: 1]
         -o, --outdir=DIR                Directory where the fragments and
                                         contigs files will be written.
                                         Defaults to current directory.
@@ -216,6 +220,8 @@ class Digest(AbstractCommand):
             self.args["--size"],
             output_dir=self.args["--outdir"],
             circular=self.args["--circular"],
+            cache=self.args["--cache"],
+            threads=int(self.args["--threads"]),
         )
 
         hcd.frag_len(
@@ -612,7 +618,8 @@ class Pipeline(AbstractCommand):
     usage:
         pipeline [--aligner=bowtie2] [--centromeres=FILE] [--circular] [--distance-law]
                  [--duplicates] [--enzyme=ENZ] [--filter] [--force] [--iterative] 
-                 [--matfmt=FMT] [--no-cleanup] [--outdir=DIR] [--plot] [--prefix=PREFIX]
+                 [--matfmt=FMT] [--no-cleanup] [--outdir=DIR] [--parallel-align]
+                 [--plot] [--prefix=PREFIX]
                  [--quality-min=INT] [--read-len=INT] [--remove-centromeres=INT] [--size=INT]
                  [--start-stage=STAGE] [--threads=INT] [--tmpdir=DIR] --genome=FILE <input1> [<input2>]
 
@@ -671,6 +678,10 @@ class Pipeline(AbstractCommand):
                                       Disabled by defaut.
         -o, --outdir=DIR              Output directory. Defaults to the current
                                       directory.
+        --parallel-align              Align forward and reverse reads at the
+                                      same time, each with half of the
+                                      threads. Requires twice the memory of
+                                      the aligner.
         -p, --plot                    Generates plots in the output directory
                                       at different steps of the pipeline.
         -P, --prefix=PREFIX           Overrides default filenames and prefixes all
@@ -749,6 +760,7 @@ class Pipeline(AbstractCommand):
             start_stage=self.args["--start-stage"],
             threads=int(self.args["--threads"]),
             tmp_dir=self.args["--tmpdir"],
+            parallel_align=self.args["--parallel-align"],
         )
 
 
@@ -1153,7 +1165,8 @@ class Distancelaw(AbstractCommand):
         distancelaw [--average] [--big-arm-only=INT] [--base=FLOAT] [--centromeres=FILE] 
                     [--circular] [--frags=FILE] [--inf=INT] [--outputfile-img=IMG] 
                     [--outputfile-tabl=TABLE] [--labels=DIR] [--sup=INT] 
-                    [--remove-centromeres=INT] (--pairs=FILE | --dist-tbl=FILE1[,FILE2,...])
+                    [--remove-centromeres=INT] [--threads=INT]
+                    (--pairs=FILE | --dist-tbl=FILE1[,FILE2,...])
     
     options:
         -a, --average                       If set, calculate the average of the distance 
@@ -1202,6 +1215,9 @@ class Distancelaw(AbstractCommand):
                                             the dataset given. Also if big arm only set, it
                                             will be the minimum size of the arms/chromosomes
                                             taken to make the average.
+        -t, --threads=INT                   Number of threads used to count the
+                                            contacts of the pairs in parallel.
+                                            [default: 1]
     """
 
     def execute(self):
@@ -1254,6 +1270,7 @@ class Distancelaw(AbstractCommand):
                 out_file=output_file_tabl,
                 circular=circular,
                 rm_centro=rm_centro,
+                threads=int(self.args["--threads"]),
             )
             length_files = 1
         else:
@@ -1374,7 +1391,7 @@ class Missview(AbstractCommand):
                         fq_handle.write('@NS_SIM_%s_%i\n' % (rec.id, i))
                         fq_handle.write(str(rec.seq[i:i+read_len]))
                         fq_handle.write('\n+\n' + phred + '\n')
-        # Map reads to genome
+        # Map reads to genome, alignments are sorted by name in the output
         hpi.align_reads(
             tmp_fq,
             genome,
@@ -1383,11 +1400,6 @@ class Missview(AbstractCommand):
             threads=threads,
             aligner=aligner,
         )
-        # Sort alignments by name
-        ps.sort(
-            "-@", str(threads), "-n", "-O", "BAM", "-o", tmp_bam + ".sorted", tmp_bam 
-        )
-        shutil.move(tmp_bam+ ".sorted", tmp_bam)
         # Run the standard pipeline with, using twice the forward reads.
         # This will generate a diagonal-only matrix
         hpi.full_pipeline(
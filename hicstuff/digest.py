@@ -7,11 +7,16 @@ Functions used to write auxiliary instagraal compatible
 sparse matrices.
 """
 
-from Bio import SeqIO, SeqUtils
+from Bio.SeqIO.FastaIO import SimpleFastaParser
+from Bio.Seq import Seq, MutableSeq
 from Bio.Restriction import RestrictionBatch, Analysis
-import os, sys, csv
+import os, sys, re
 import collections
-import copy
+import csv
+import functools
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import zipfile
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -28,6 +33,11 @@ DEFAULT_ENZYME = "DpnII"
 # If using evenly-sized chunks instead of restriction
 # enzymes, they shouldn't be too short
 DEFAULT_MIN_CHUNK_SIZE = 50
+# Number of pairs attributed to restriction fragments at once
+DEFAULT_PAIRS_CHUNK_SIZE = 1000000
+# Lookup table flagging G, C and S (strong) bases, in either case
+GC_BYTES_TABLE = np.zeros(256, dtype=bool)
+GC_BYTES_TABLE[list(b"GCSgcs")] = True
 
 
 def write_frag_info(
@@ -38,6 +48,8 @@ def write_frag_info(
     output_contigs=DEFAULT_INFO_CONTIGS_FILE_NAME,
     output_frags=DEFAULT_FRAGMENTS_LIST_FILE_NAME,
     output_dir=None,
+    cache=False,
+    threads=1,
 ):
     """Digest and write fragment information
 
@@ -65,9 +77,29 @@ def write_frag_info(
     output_dir : [type], optional
         The path to the output directory, which will be created if not already
         existing. Default is the current directory.
+    cache : bool, optional
+        Whether restriction tables should be reused from, and saved to, an
+        on-disk cache in the user cache directory (see _digest_cache_dir).
+        The cache is keyed on the content of the fasta file, the enzyme and
+        the genome topology, and is never removed. Default is False.
+    threads : int, optional
+        Number of processes used to digest contigs in parallel. Default is 1.
+
+    Returns
+    -------
+    dict :
+        Dictionary with contig names as keys and restriction tables as values,
+        as expected by attribute_fragments.
     """
 
-    records = SeqIO.parse(fasta, "fasta")
+    records = iter_fasta(fasta)
+    size_threshold = int(min_size)
+    if cache:
+        cache_path = _digest_cache_path(fasta, enzyme, circular)
+        restriction_table = _load_digest_cache(cache_path)
+    else:
+        restriction_table = {}
+    n_cached = len(restriction_table)
 
     try:
         info_contigs_path = os.path.join(output_dir, output_contigs)
@@ -76,72 +108,344 @@ def write_frag_info(
         info_contigs_path = output_contigs
         frag_list_path = output_frags
 
-    with open(info_contigs_path, "w") as info_contigs:
+    with open(info_contigs_path, "wb") as info_contigs:
 
-        info_contigs.write("contig\tlength\tn_frags\tcumul_length\n")
+        info_contigs.write(b"contig\tlength\tn_frags\tcumul_length\n")
 
-        with open(frag_list_path, "w") as fragments_list:
+        with open(
+            frag_list_path, "wb", buffering=hio.DEFAULT_WRITE_BUFFER_SIZE
+        ) as fragments_list:
 
             fragments_list.write(
-                "id\tchrom\tstart_pos" "\tend_pos\tsize\tgc_content\n"
+                b"id\tchrom\tstart_pos" b"\tend_pos\tsize\tgc_content\n"
             )
 
             total_frags = 0
-
-            for record in records:
-                contig_seq = record.seq
-                contig_name = record.id
-                contig_length = len(contig_seq)
-                if contig_length < int(min_size):
-                    continue
-
-                sites = get_restriction_table(
-                    contig_seq, enzyme, circular=circular
-                )
-                fragments = (
-                    contig_seq[sites[i] : sites[i + 1]]
-                    for i in range(len(sites) - 1)
+            # Contig lines are small and written all at once at the end
+            contig_lines = []
+
+            # Contigs are independent and can be digested in parallel, but
+            # results are written in input order
+            contigs = (
+                (contig_name, contig_seq, restriction_table.get(contig_name))
+                for contig_name, contig_seq in records
+                if len(contig_seq) >= size_threshold
+            )
+            digest_contig = functools.partial(
+                _digest_contig, enzyme=enzyme, circular=circular
+            )
+            if threads > 1:
+                executor = ProcessPoolExecutor(max_workers=threads)
+                digested = _digest_in_pool(
+                    executor, digest_contig, contigs, 2 * threads
                 )
-                n_frags = 0
-
-                current_id = 1
-                start_pos = 0
-                for frag in fragments:
-                    frag_length = len(frag)
-                    if frag_length > 0:
-                        end_pos = start_pos + frag_length
-                        gc_content = SeqUtils.GC(frag) / 100.0
-
-                        current_fragment_line = "%s\t%s\t%s\t%s\t%s\t%s\n" % (
-                            current_id,
-                            contig_name,
-                            start_pos,
-                            end_pos,
-                            frag_length,
-                            gc_content,
-                        )
-
-                        fragments_list.write(current_fragment_line)
-
-                        try:
-                            assert (current_id == 1 and start_pos == 0) or (
-                                current_id > 1 and start_pos > 0
-                            )
-                        except AssertionError:
-                            logger.error((current_id, start_pos))
-                            raise
-                        start_pos = end_pos
-                        current_id += 1
-                        n_frags += 1
-
-                current_contig_line = "%s\t%s\t%s\t%s\n" % (
+            else:
+                executor = None
+                digested = map(digest_contig, contigs)
+
+            try:
+                for (
                     contig_name,
                     contig_length,
+                    sites,
+                    frag_lines,
                     n_frags,
-                    total_frags,
-                )
-                total_frags += n_frags
-                info_contigs.write(current_contig_line)
+                ) in digested:
+                    restriction_table[contig_name] = sites
+                    fragments_list.write(frag_lines)
+                    contig_lines.append(
+                        "%s\t%d\t%d\t%d\n"
+                        % (contig_name, contig_length, n_frags, total_frags)
+                    )
+                    total_frags += n_frags
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+        info_contigs.write("".join(contig_lines).encode())
+
+    # Only update the cache if new contigs were digested
+    if cache and len(restriction_table) > n_cached:
+        _save_digest_cache(cache_path, restriction_table)
+
+    return restriction_table
+
+
+def _digest_contig(contig, enzyme, circular=False):
+    """
+    Digest a single contig and format its lines of the fragments list.
+
+    Parameters
+    ----------
+    contig : tuple
+        Name (str), sequence (bytes) and restriction table of the contig. The
+        restriction table can be None, in which case it is computed.
+    enzyme : str, int or list of str
+        The enzyme(s) or chunk size used for digestion.
+    circular : bool
+        Whether the genome is circular.
+
+    Returns
+    -------
+    contig_name : str
+        Name of the contig.
+    contig_length : int
+        Length of the contig in basepairs.
+    sites : numpy.array
+        The restriction table of the contig.
+    frag_lines : bytes
+        Encoded lines of the fragments list for this contig.
+    n_frags : int
+        Number of fragments in the contig.
+    """
+    contig_name, contig_seq, sites = contig
+    if sites is None:
+        sites = get_restriction_table(contig_seq, enzyme, circular=circular)
+    # Fragment coordinates and GC content are computed for the whole contig
+    # at once, lines are then formatted in one pass
+    starts, ends, sizes, gc_contents = get_fragments_info(contig_seq, sites)
+    n_frags = len(sizes)
+    frag_lines = "".join(
+        "%d\t%s\t%d\t%d\t%d\t%s\n"
+        % (frag_id, contig_name, start, end, size, gc)
+        for frag_id, start, end, size, gc in zip(
+            range(1, n_frags + 1),
+            starts.tolist(),
+            ends.tolist(),
+            sizes.tolist(),
+            gc_contents.tolist(),
+        )
+    ).encode()
+    return contig_name, len(contig_seq), sites, frag_lines, n_frags
+
+
+def _digest_in_pool(executor, digest_contig, contigs, max_pending):
+    """
+    Digest contigs in a process pool and yield results in input order. Only
+    max_pending contigs are submitted at any time, so that the genome is not
+    loaded in memory at once.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The pool in which contigs are digested.
+    digest_contig : callable
+        Function digesting a single contig, as _digest_contig.
+    contigs : iterable
+        Arguments of digest_contig for each contig.
+    max_pending : int
+        Maximum number of contigs submitted and not yet yielded.
+
+    Yields
+    ------
+    tuple :
+        The result of digest_contig for each contig.
+    """
+    pending = collections.deque()
+    for contig in contigs:
+        pending.append(executor.submit(digest_contig, contig))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_fasta(fasta):
+    """
+    Iterate over the sequences of a fasta file without building Biopython
+    SeqRecord or Seq objects.
+
+    Parameters
+    ----------
+    fasta : pathlib.Path or str
+        The path to the fasta file.
+
+    Yields
+    ------
+    name : str
+        Identifier of the sequence (first word of its header).
+    seq : bytes
+        The raw sequence.
+    """
+    with open(fasta, "r") as fasta_handle:
+        for title, seq in SimpleFastaParser(fasta_handle):
+            name = title.split(None, 1)[0] if title else ""
+            yield name, seq.encode()
+
+
+def _digest_cache_dir():
+    """
+    Return the directory where restriction tables are cached. This is the
+    hicstuff subdirectory of $XDG_CACHE_HOME, or of ~/.cache if it is not set.
+
+    Returns
+    -------
+    str :
+        Path to the cache directory. It is not created by this function.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "hicstuff")
+
+
+def _digest_cache_path(fasta, enzyme, circular=False):
+    """
+    Build the path of the restriction tables cache file for a given genome
+    and digestion setting. The genome is identified by the sha256 digest of
+    its content so that the cache is invalidated whenever it changes.
+
+    Parameters
+    ----------
+    fasta : pathlib.Path or str
+        The path to the reference genome.
+    enzyme : str, int or list of str
+        The enzyme(s) or chunk size used for digestion.
+    circular : bool
+        Whether the genome is circular.
+
+    Returns
+    -------
+    str :
+        Path to the .npz cache file in the user cache directory.
+    """
+    fasta_hash = hashlib.sha256()
+    with open(fasta, "rb") as fasta_handle:
+        for block in iter(lambda: fasta_handle.read(2 ** 20), b""):
+            fasta_hash.update(block)
+    if isinstance(enzyme, (list, tuple)):
+        enzyme = "-".join(map(str, enzyme))
+    enzyme = re.sub(r"[^\w.-]", "_", str(enzyme))
+    topology = "circular" if circular else "linear"
+    return os.path.join(
+        _digest_cache_dir(),
+        "hicstuff_digest_{}_{}_{}.npz".format(
+            fasta_hash.hexdigest(), enzyme, topology
+        ),
+    )
+
+
+def _load_digest_cache(cache_path):
+    """
+    Load cached restriction tables.
+
+    Parameters
+    ----------
+    cache_path : str
+        Path to the .npz cache file.
+
+    Returns
+    -------
+    dict :
+        Dictionary with contig names as keys and restriction tables as
+        values. Empty if the cache does not exist, cannot be read or belongs
+        to another user.
+    """
+    try:
+        # Only trust cache files written by the current user
+        if hasattr(os, "getuid") and os.stat(cache_path).st_uid != os.getuid():
+            logger.warning("Ignoring digestion cache of another user")
+            return {}
+        with np.load(cache_path) as cached:
+            names, bounds, sites = (
+                cached["names"],
+                cached["bounds"],
+                cached["sites"],
+            )
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return {}
+    return {
+        name: sites[bounds[i] : bounds[i + 1]]
+        for i, name in enumerate(names.tolist())
+    }
+
+
+def _save_digest_cache(cache_path, restriction_table):
+    """
+    Save restriction tables to an .npz cache file. Failure to write the cache
+    is not fatal.
+
+    Parameters
+    ----------
+    cache_path : str
+        Path to the .npz cache file.
+    restriction_table : dict
+        Dictionary with contig names as keys and restriction tables as values.
+    """
+    names = list(restriction_table)
+    tables = [np.asarray(restriction_table[name]) for name in names]
+    bounds = np.cumsum([0] + [len(table) for table in tables])
+    # Write to a temporary file first to avoid leaving a truncated cache
+    tmp_path = "{}.{}.tmp.npz".format(cache_path[:-4], os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        np.savez_compressed(
+            tmp_path,
+            names=np.array(names, dtype=str),
+            bounds=bounds,
+            sites=np.concatenate(tables).astype(np.int64),
+        )
+        os.replace(tmp_path, cache_path)
+    except OSError as err:
+        logger.warning("Could not write digestion cache: %s", err)
+
+
+def get_fragments_info(seq, sites):
+    """
+    Compute the coordinates and GC content of all restriction fragments of a
+    sequence at once. Empty fragments (e.g. when two enzymes cut at the same
+    position) are discarded.
+
+    Parameters
+    ----------
+    seq : bytes
+        The sequence of a chromosome or contig.
+    sites : numpy.array
+        Sorted restriction fragment boundaries in the sequence, as returned
+        by get_restriction_table.
+
+    Returns
+    -------
+    starts : numpy.array of int
+        0-based start position of each fragment.
+    ends : numpy.array of int
+        0-based end position (excluded) of each fragment.
+    sizes : numpy.array of int
+        Length of each fragment in basepairs.
+    gc_contents : numpy.array of float
+        Proportion of G, C or S bases in each fragment.
+
+    >>> seq, sites = b"AAGATCGAtcgg", [0, 2, 6, 6, 12]
+    >>> starts, ends, sizes, gc = get_fragments_info(seq, sites)
+    >>> starts, ends, sizes
+    (array([0, 2, 6]), array([ 2,  6, 12]), array([2, 4, 6]))
+    >>> gc
+    array([0.        , 0.5       , 0.66666667])
+    >>> get_fragments_info(seq, [0, 6, 2, 12])
+    Traceback (most recent call last):
+        ...
+    ValueError: The restriction table must be sorted and start at position 0.
+    """
+    sites = np.asarray(sites, dtype=np.int64)
+    sizes = np.diff(sites)
+    # Single check of the invariant for all fragments of the sequence
+    if sites[0] != 0 or np.any(sizes < 0):
+        raise ValueError(
+            "The restriction table must be sorted and start at position 0."
+        )
+    nonempty = sizes > 0
+    starts = sites[:-1][nonempty]
+    ends = sites[1:][nonempty]
+    sizes = sizes[nonempty]
+    # Number of GC bases before each position, so that GC count in a
+    # fragment is the difference between its boundaries
+    is_gc = GC_BYTES_TABLE[np.frombuffer(seq, dtype=np.uint8)]
+    gc_cumul = np.zeros(len(is_gc) + 1, dtype=np.int64)
+    np.cumsum(is_gc, out=gc_cumul[1:])
+    # GC content goes through a percentage first, as with Bio.SeqUtils.GC,
+    # so that values are identical to the last digit
+    gc_contents = (gc_cumul[ends] - gc_cumul[starts]) * 100.0 / sizes / 100.0
+    return starts, ends, sizes, gc_contents
 
 
 def attribute_fragments(pairs_file, idx_pairs_file, restriction_table):
@@ -163,13 +467,10 @@ def attribute_fragments(pairs_file, idx_pairs_file, restriction_table):
         on whole genome.
     restriction_table: dict
         Dictionary with chromosome identifiers (str) as keys and list of
-        positions (int) of restriction sites as values.
+        positions (int) of restriction sites as values. Pairs on chromosomes
+        missing from it are discarded.
     """
 
-    # NOTE: Bottlenecks here are 1. binary search in find_frag and 2. writerow
-    # 1. could be reduced by searching groups of N frags in parallel and 2. by
-    # writing N frags simultaneously using a single call of writerows.
-
     # Parse and update header section
     pairs_header = hio.get_pairs_header(pairs_file)
     header_size = len(pairs_header)
@@ -183,76 +484,74 @@ def attribute_fragments(pairs_file, idx_pairs_file, restriction_table):
                 chrom_order.append(line.split()[1])
             idx_pairs.write(line + "\n")
 
-    # Get number of fragments per chrom to allow genome-based indices
-    shift_frags = {}
-    prev_frags = 0
-    for rank, chrom in enumerate(chrom_order):
-        if rank > 0:
-            # Note the "-1" because there are nfrags + 1 sites in rest table
-            prev_frags += len(restriction_table[chrom_order[rank - 1]]) - 1
-        # Idx of each chrom's frags will be shifted by n frags in previous chroms
-        shift_frags[chrom] = prev_frags
+    # Restriction tables of all chromosomes are searched at once, fragment
+    # indices being genome-based in the order of the header. Contigs without
+    # a restriction table (e.g. filtered out by size) cannot be indexed.
+    chrom_order = [chrom for chrom in chrom_order if chrom in restriction_table]
+    sites, offsets = flatten_restriction_table(restriction_table, chrom_order)
+    chrom_ranks = {chrom: rank for rank, chrom in enumerate(chrom_order)}
 
     missing_contigs = set()
+    # Columns are kept as text to be written back unchanged, only positions
+    # are parsed. Lines are terminated by LF, as in bam2pairs.
+    pairs_reader = pd.read_csv(
+        pairs_file,
+        sep="\t",
+        header=None,
+        skiprows=header_size,
+        usecols=range(7),
+        names=["readID", "chr1", "pos1", "chr2", "pos2", "strand1", "strand2"],
+        dtype=str,
+        quoting=csv.QUOTE_NONE,
+        keep_default_na=False,
+        chunksize=DEFAULT_PAIRS_CHUNK_SIZE,
+    )
     # Attribute pairs to fragments and append them to output file (after header)
-    with open(pairs_file, "r") as pairs, open(
-        idx_pairs_file, "a"
+    with open(
+        idx_pairs_file,
+        "a",
+        newline="",
+        buffering=hio.DEFAULT_WRITE_BUFFER_SIZE,
     ) as idx_pairs:
-        # Skip header lines
-        for _ in range(header_size):
-            next(pairs)
-
-        # Define input and output fields
-        pairs_cols = [
-            "readID",
-            "chr1",
-            "pos1",
-            "chr2",
-            "pos2",
-            "strand1",
-            "strand2",
-        ]
-        idx_cols = pairs_cols + ["frag1", "frag2"]
-
-        # Use csv reader / writer to automatically parse columns into a dict
-        pairs_reader = csv.DictReader(
-            pairs, fieldnames=pairs_cols, delimiter="\t"
-        )
-        pairs_writer = csv.DictWriter(
-            idx_pairs, fieldnames=idx_cols, delimiter="\t"
-        )
-
-        for pair in pairs_reader:
+        for pairs in pairs_reader:
+            # Skip incomplete lines
+            pairs = pairs[pairs.strand2 != ""]
+            rank1 = pairs.chr1.map(chrom_ranks)
+            rank2 = pairs.chr2.map(chrom_ranks)
+            # Pairs on contigs absent from the header or from the restriction
+            # table cannot be indexed
+            indexed = (rank1.notna() & rank2.notna()).values
+            if not indexed.all():
+                missing_contigs.update(pairs.chr1[rank1.isna()])
+                missing_contigs.update(pairs.chr2[rank2.isna()])
+                pairs = pairs[indexed]
+                rank1, rank2 = rank1[indexed], rank2[indexed]
             # Get the 0-based indices of corresponding restriction fragments
             # Deducing 1 from pair position to get it into 0bp point
-            pair["frag1"] = find_frag(
-                int(pair["pos1"]) - 1, restriction_table[pair["chr1"]]
-            )
-            pair["frag2"] = find_frag(
-                int(pair["pos2"]) - 1, restriction_table[pair["chr2"]]
-            )
-            # Shift fragment indices to make them genome-based instead of
-            # chromosome-based
-            try:
-                pair["frag1"] += shift_frags[pair["chr1"]]
-            except KeyError:
-                missing_contigs.add(pair["chr1"])
-            try:
-                pair["frag2"] += shift_frags[pair["chr2"]]
-            except KeyError:
-                missing_contigs.add(pair["chr2"])
-
-            # Write indexed pairs in the new file
-            pairs_writer.writerow(pair)
-
-        if missing_contigs:
-            logger.warning(
-                "Pairs on the following contigs were discarded as "
-                "those contigs are not listed in the paris file header. "
-                "This is normal if you filtered out small contigs: %s"
-                % " ".join(list(missing_contigs))
+            frags = {
+                "frag" + end: find_frags(
+                    ranks.values.astype(np.int64),
+                    pairs["pos" + end].values.astype(np.int64) - 1,
+                    sites,
+                    offsets,
+                )
+                for end, ranks in (("1", rank1), ("2", rank2))
+            }
+            idx_pairs.write(
+                pairs.assign(**frags).to_csv(
+                    sep="\t", header=False, index=False, quoting=csv.QUOTE_NONE
+                )
             )
 
+    if missing_contigs:
+        logger.warning(
+            "Pairs on the following contigs were discarded as "
+            "those contigs are not listed in the pairs file header or "
+            "have no restriction table. "
+            "This is normal if you filtered out small contigs: %s"
+            % " ".join(list(missing_contigs))
+        )
+
 
 def get_restriction_table(seq, enzyme, circular=False):
     """
@@ -260,8 +559,9 @@ def get_restriction_table(seq, enzyme, circular=False):
 
     Parameters
     ----------
-    seq : Seq object
-        A biopython Seq object representing a chromosomes or contig.
+    seq : Seq object, str or bytes
+        A biopython Seq object or a raw sequence representing a chromosome
+        or contig.
     enzyme : int, str or list of str
         The name of the restriction enzyme used, or a list of restriction
         enzyme names. Can also be an integer, to digest by fixed chunk size.
@@ -282,12 +582,14 @@ def get_restriction_table(seq, enzyme, circular=False):
     Traceback (most recent call last):
         ...
     ValueError: aeiou1 is not a valid restriction enzyme.
-    >>> get_restriction_table("AA","DpnII")
-    Traceback (most recent call last):
-        ...
-    TypeError: Expected Seq or MutableSeq instance, got <class 'str'> instead
+    >>> get_restriction_table(b"AAGATCGATCGG", "DpnII")
+    array([ 0,  2,  6, 12])
+    >>> get_restriction_table("AAGATCGATCGG", "DpnII", circular=True)
+    array([ 0,  2,  6, 12])
 
     """
+    if isinstance(seq, str):
+        seq = seq.encode()
     chrom_len = len(seq)
     wrong_enzyme = "{} is not a valid restriction enzyme.".format(enzyme)
     # Restriction batch containing the restriction enzyme
@@ -305,7 +607,29 @@ def get_restriction_table(seq, enzyme, circular=False):
         sites = [i for i in range(0, chrom_len, cutter)]
         if sites[-1] < chrom_len:
             sites.append(chrom_len)
+    elif not circular and all(
+        enz.is_palindromic() and enz.cut_once() for enz in cutter
+    ):
+        # Fast path for the common case: scan raw bytes directly instead of
+        # going through Biopython's Analysis machinery
+        seq_bytes = bytes(seq).upper()
+        sites = []
+        for enz in cutter:
+            site_regex = _get_site_regex(str(enz))
+            sites += [
+                match.start() + enz.fst5
+                for match in site_regex.finditer(seq_bytes)
+            ]
+        # Discard cuts falling outside the sequence, as Analysis does for
+        # linear sequences
+        sites = [site for site in sites if 0 < site < chrom_len]
+        sites.sort()
+        sites.insert(0, 0)
+        sites.append(chrom_len)
     else:
+        # Analysis only works on biopython sequence objects
+        if not isinstance(seq, (Seq, MutableSeq)):
+            seq = Seq(bytes(seq).decode())
         # Find sites of all restriction enzymes given
         ana = Analysis(cutter, seq, linear=not circular)
         sites = ana.full()
@@ -319,6 +643,31 @@ def get_restriction_table(seq, enzyme, circular=False):
     return np.array(sites)
 
 
+@functools.lru_cache(maxsize=None)
+def _get_site_regex(enzyme):
+    """
+    Compile the recognition site pattern of a restriction enzyme into a
+    regular expression matching (possibly overlapping) sites in uppercase
+    raw bytes.
+
+    Parameters
+    ----------
+    enzyme : str
+        The name of the restriction enzyme.
+
+    Returns
+    -------
+    re.Pattern :
+        The compiled bytes pattern. The start of each match is the 0-based
+        position of the first base of the recognition site.
+
+    >>> [m.start() for m in _get_site_regex("HinfI").finditer(b"GAATCGACTC")]
+    [0, 5]
+    """
+    enz = RestrictionBatch([enzyme]).get(enzyme)
+    return re.compile(enz.compsite.pattern.encode())
+
+
 def find_frag(pos, r_sites):
     """
     Use binary search to find the index of a chromosome restriction fragment
@@ -362,6 +711,101 @@ def find_frag(pos, r_sites):
     return index
 
 
+def flatten_restriction_table(restriction_table, chrom_order):
+    """
+    Concatenate the restriction tables of several chromosomes into a single
+    sorted array, as used by find_frags. Sites of each chromosome are shifted
+    by the cumulative length of the previous chromosomes.
+
+    Parameters
+    ----------
+    restriction_table : dict
+        Dictionary with chromosome identifiers (str) as keys and list of
+        positions (int) of restriction sites as values.
+    chrom_order : list of str
+        Chromosomes to include, in the order of genome-based fragment
+        indices.
+
+    Returns
+    -------
+    sites : numpy.array of int
+        Shifted restriction sites of all chromosomes.
+    offsets : numpy.array of int
+        Index of the first site of each chromosome in sites, followed by the
+        total number of sites.
+
+    >>> sites, offsets = flatten_restriction_table(
+    ...     {"a": [0, 5, 10], "b": [0, 3, 8]}, ["a", "b"]
+    ... )
+    >>> sites, offsets
+    (array([ 0,  5, 10, 10, 13, 18]), array([0, 3, 6]))
+    """
+    tables = [
+        np.asarray(restriction_table[chrom], dtype=np.int64)
+        for chrom in chrom_order
+    ]
+    offsets = np.cumsum([0] + [len(table) for table in tables])
+    # Each table ends with the chromosome length
+    chrom_starts = np.cumsum([0] + [table[-1] for table in tables[:-1]])
+    sites = np.concatenate(
+        [table + start for table, start in zip(tables, chrom_starts)]
+        or [np.zeros(0, dtype=np.int64)]
+    )
+    return sites, offsets
+
+
+def find_frags(chrom_ranks, positions, sites, offsets):
+    """
+    Vectorized version of find_frag for positions on different chromosomes,
+    returning genome-based fragment indices.
+
+    Parameters
+    ----------
+    chrom_ranks : numpy.array of int
+        Rank of the chromosome of each position in the flattened tables.
+    positions : numpy.array of int
+        0-based positions, in base pairs.
+    sites : numpy.array of int
+        Flattened restriction tables, as returned by
+        flatten_restriction_table.
+    offsets : numpy.array of int
+        Index of the first site of each chromosome in sites, as returned by
+        flatten_restriction_table.
+
+    Returns
+    -------
+    numpy.array of int
+        The 0-based genome-based index of the restriction fragment to which
+        each position belongs.
+
+    >>> sites, offsets = flatten_restriction_table(
+    ...     {"a": [0, 5, 10], "b": [0, 3, 8]}, ["a", "b"]
+    ... )
+    >>> find_frags([0, 0, 0, 1, 1, 1], [0, 7, 10, 0, 4, 8], sites, offsets)
+    array([0, 1, 1, 2, 3, 3])
+    >>> find_frags([1], [9], sites, offsets)
+    Traceback (most recent call last):
+        ...
+    ValueError: Read position is larger than last entry in restriction table.
+    """
+    chrom_ranks = np.asarray(chrom_ranks, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    first_site = offsets[chrom_ranks]
+    last_site = offsets[chrom_ranks + 1] - 1
+    chrom_starts = sites[first_site]
+    if np.any(positions > sites[last_site] - chrom_starts):
+        raise ValueError(
+            "Read position is larger than last entry in restriction table."
+        )
+    index = (
+        np.searchsorted(sites, positions + chrom_starts, side="right") - 1
+    )
+    # Last site = end of the chrom, index of last fragment is last site - 1
+    index = np.clip(index, first_site, last_site - 1)
+    # There is one less fragment than sites in each chromosome
+    return index - chrom_ranks
+
+
 def frag_len(
     frags_file_name=DEFAULT_FRAGMENTS_LIST_FILE_NAME,
     output_dir=None,
@@ -388,13 +832,16 @@ def frag_len(
         frag_list_path = os.path.join(output_dir, frags_file_name)
     except TypeError:
         frag_list_path = frags_file_name
-    frags = pd.read_csv(frag_list_path, sep="\t")
-    nfrags = frags.shape[0]
-    med_len = frags["size"].median()
+    # Only fragment sizes are needed for the summary and histogram
+    sizes = pd.read_csv(
+        frag_list_path, sep="\t", usecols=["size"], dtype={"size": np.int64}
+    )["size"].values
+    nfrags = sizes.size
+    med_len = np.median(sizes)
     nbins = 40
     if plot:
         fig, ax = plt.subplots()
-        _, _, _ = ax.hist(frags["size"], bins=nbins)
+        _, _, _ = ax.hist(sizes, bins=nbins)
 
         ax.set_xlabel("Fragment length [bp]")
         ax.set_ylabel("Log10 number of fragments")
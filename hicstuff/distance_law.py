@@ -3,6 +3,10 @@
 
 import numpy as np
 import sys
+import collections
+import functools
+import hashlib
+import tempfile
 import matplotlib.pyplot as plt
 import warnings
 from scipy import ndimage
@@ -10,9 +14,19 @@ from matplotlib import cm
 import pandas as pd
 import os as os
 import csv as csv
+from concurrent.futures import ThreadPoolExecutor
+import hicstuff.digest as hcd
 import hicstuff.io as hio
 from hicstuff.log import logger
 
+# Number of pairs read and processed at once when computing distance law
+DEFAULT_CHUNK_SIZE = 1000000
+# Record of the binary cache of pairs files, with strands encoded as 1 for
+# "+" and -1 for "-"
+PAIRS_CACHE_DTYPE = np.dtype(
+    [("frag1", "<i4"), ("frag2", "<i4"), ("strand1", "i1"), ("strand2", "i1")]
+)
+
 
 def export_distance_law(xs, ps, names, out_dir=None):
     """ Export the x(s) and p(s) from two list of numpy.ndarrays to a table
@@ -31,8 +45,8 @@ def export_distance_law(xs, ps, names, out_dir=None):
         List containing the names of the chromosomes/arms/conditions of the p(s)
         values given.
     out_dir : str or None
-        Path where output files should be written. Current directory by
-        default.
+        Path of the output file. By default, a "distance_law.txt" file is
+        written in the current directory.
 
     Return
     ------
@@ -42,27 +56,31 @@ def export_distance_law(xs, ps, names, out_dir=None):
          or chromosome. The file is createin the directory given by outdir or
          the current directory if no directory given.
     """
-    # Give the current directory as out_dir if no out_dir is given.
+    # Write in the current directory if no out_dir is given.
     if out_dir is None:
-        out_dir = os.getcwd() + "/distance_law.txt"
+        out_dir = os.path.join(os.getcwd(), "distance_law.txt")
     # Sanity check: as many chromosomes/arms as ps
     if len(xs) != len(names):
         logger.error("Number of chromosomes/arms and number of p(s) list differ.")
         sys.exit(1)
-    # Create the file and write it
-    f = open(out_dir, "w")
-    for i in range(len(xs)):
-        for j in range(len(xs[i])):
-            line = (
-                str(format(xs[i][j], "g"))
-                + "\t"
-                + str(format(ps[i][j], "g"))
-                + "\t"
-                + names[i]
-                + "\n"
-            )
-            f.write(line)
-    f.close()
+    # Create the table and write it at once. Both numeric columns are written
+    # as floats in the shortest notation.
+    table = pd.DataFrame(
+        {
+            "xs": np.concatenate(xs).astype(np.float64),
+            "ps": np.concatenate([np.asarray(p, np.float64) for p in ps]),
+            "names": np.repeat(names, [len(x) for x in xs]),
+        }
+    )
+    table.to_csv(
+        out_dir,
+        sep="\t",
+        header=False,
+        index=False,
+        float_format="%g",
+        na_rep="nan",
+        quoting=csv.QUOTE_NONE,
+    )
 
 
 def import_distance_law(distance_law_file):
@@ -92,16 +110,12 @@ def import_distance_law(distance_law_file):
         header=None,
         dtype={"a": np.int32, "b": np.float32, "c": str},
     )
-    names_idx = np.unique(file.iloc[:, 2], return_index=True)[1]
-    names = [file.iloc[:, 2][index] for index in sorted(names_idx)]
-    xs = [None] * len(names)
-    ps = [None] * len(names)
-    labels = [None] * len(names)
-    for i in range(len(names)):
-        subfile = file[file.iloc[:, 2] == names[i]]
-        xs[i] = np.array(subfile.iloc[:, 0])
-        ps[i] = np.array(subfile.iloc[:, 1])
-        labels[i] = np.array(subfile.iloc[:, 2])
+    # Split the table by chromosome/arm, in their order of appearance
+    xs, ps, labels = [], [], []
+    for _, subfile in file.groupby(file.columns[2], sort=False):
+        xs.append(np.array(subfile.iloc[:, 0]))
+        ps.append(np.array(subfile.iloc[:, 1]))
+        labels.append(np.array(subfile.iloc[:, 2]))
     return xs, ps, labels
 
 
@@ -131,8 +145,9 @@ def get_chr_segment_bins_index(fragments, centro_file=None, rm_centro=0):
         The start and end indices of chromosomes/arms to compute the distance
         law on each chromosome/arm separately.
     """
-    # Get bins where chromosomes start
-    chr_start_bins = np.where(fragments == 0)[0]
+    # Get bins where chromosomes start, i.e. fragments starting at position 0.
+    # Fragment IDs start at 1, so only the start_pos column is scanned.
+    chr_start_bins = np.flatnonzero(fragments["start_pos"].to_numpy() == 0)
     # Create a list of same length for the end of the bins
     chr_end_bins = np.zeros(len(chr_start_bins))
     # Get bins where chromsomes end
@@ -155,22 +170,19 @@ def get_chr_segment_bins_index(fragments, centro_file=None, rm_centro=0):
             centro_file = None
     if centro_file is not None:
         # Get bins of centromeres
+        centro_pos = np.asarray(centro_pos, dtype=np.int64)
         centro_bins = np.zeros(2 * len(centro_pos))
+        start_pos = fragments["start_pos"].to_numpy(dtype=np.int64)
         for i in range(len(chr_start_bins)):
-            if (i + 1) < len(chr_start_bins):
-                subfrags = fragments[chr_start_bins[i] : chr_start_bins[i + 1]]
-            else:
-                subfrags = fragments[chr_start_bins[i] :]
-            # index of last fragment starting before centro in same chrom
-            centro_bins[2 * i] = chr_start_bins[i] + max(
-                np.where(
-                    subfrags["start_pos"][:] // (int(centro_pos[i]) - rm_centro) == 0
-                )[0]
+            chr_start, chr_end = chr_start_bins[i], int(chr_end_bins[i])
+            # index of last fragment starting before each limit of the region
+            # around the centro in same chrom
+            limits = (centro_pos[i] - rm_centro, centro_pos[i] + rm_centro)
+            centro_idx = np.searchsorted(
+                start_pos[chr_start:chr_end], limits, side="left"
             )
-            centro_bins[2 * i + 1] = chr_start_bins[i] + max(
-                np.where(
-                    subfrags["start_pos"][:] // (int(centro_pos[i]) + rm_centro) == 0
-                )[0]
+            centro_bins[2 * i : 2 * i + 2] = chr_start + np.maximum(
+                centro_idx - 1, 0
             )
         # Combine centro and chrom bins into a single array. Values are the id
         # of the bins started and ending the arms.
@@ -200,21 +212,15 @@ def get_chr_segment_length(fragments, chr_segment_bins):
     list of numpy.ndarray:
         The length in base pairs of each chromosome or arm.
     """
-    chr_segment_length = [None] * int(len(chr_segment_bins) / 2)
-    # Iterate in chr_segment_bins in order to obtain the size of each chromosome/arm
-    for i in range(len(chr_segment_length)):
-        # Obtain the size of the chromosome/arm, the if loop is to avoid the
-        # case of arms where the end position of the last fragments doesn't
-        # mean the size of arm. If it's the right arm we have to start to count the
-        # size from the beginning of the arm.
-        if fragments["start_pos"].iloc[int(chr_segment_bins[2 * i])] == 0:
-            n = fragments["end_pos"].iloc[int(chr_segment_bins[2 * i + 1]) - 1]
-        else:
-            n = (
-                fragments["end_pos"].iloc[int(chr_segment_bins[2 * i + 1]) - 1]
-                - fragments["start_pos"].iloc[int(chr_segment_bins[2 * i])]
-            )
-        chr_segment_length[i] = n
+    start_pos = fragments["start_pos"].to_numpy(dtype=np.int64)
+    end_pos = fragments["end_pos"].to_numpy(dtype=np.int64)
+    chr_segment_bins = np.asarray(chr_segment_bins, dtype=np.int64)
+    # The size of each chromosome/arm is the distance between the start of its
+    # first fragment and the end of its last one. For the right arms, we have
+    # to start to count the size from the beginning of the arm.
+    chr_segment_length = (
+        end_pos[chr_segment_bins[1::2] - 1] - start_pos[chr_segment_bins[::2]]
+    ).tolist()
     return chr_segment_length
 
 
@@ -255,9 +261,11 @@ def logbins_xs(fragments, chr_segment_length, base=1.1, circular=False):
         n_bins = int(np.log(n) / np.log(base))
         # For each chromosome/arm compute a logspace to have the logbin
         # equivalent to the size of the arms and increasing size of bins
-        xs[i] = np.unique(
-            np.logspace(0, n_bins, num=n_bins + 1, base=base, dtype=np.int)
-        )
+        powers = np.power(base, np.arange(n_bins + 1, dtype=np.float64))
+        powers = powers.astype(np.int64)
+        # The truncated powers are sorted, only keep the first occurrence of
+        # each value.
+        xs[i] = powers[np.concatenate(([True], powers[1:] != powers[:-1]))]
     return xs
 
 
@@ -267,17 +275,16 @@ def circular_distance_law(distance, chr_segment_length, chr_bin):
 
     Parameters
     ----------
-    chr_segment_bins : list of floats
-        The start and end indices of chromosomes/arms to compute the distance
-        law on each chromosome/arm separately.
+    distance : int or numpy.ndarray of ints
+        Distance between two fragments with a contact.
     chr_segment_length: list of floats
         List of the size in base pairs of the different arms or chromosomes.
-    distance : int
-        Distance between two fragments with a contact.
+    chr_bin : int or numpy.ndarray of ints
+        Index of the chromosome/arm of the contact(s) in chr_segment_length.
 
     Returns
     -------
-    int :
+    int or numpy.ndarray of ints :
         The real distance in the chromosome circular and not the distance 
         between two genomic positions
 
@@ -289,11 +296,15 @@ def circular_distance_law(distance, chr_segment_length, chr_bin):
     1300
     >>> circular_distance_law(1400, [2800, 9000], 0)
     1400
+    >>> circular_distance_law(np.array([7500, 1400]), [2800, 9000], [1, 0])
+    array([1500, 1400])
     """
-    chr_len = chr_segment_length[chr_bin]
-    if distance > chr_len / 2:
-        distance = chr_len - distance
-    return distance
+    chr_len = np.asarray(chr_segment_length)[chr_bin]
+    circular_distance = np.minimum(distance, chr_len - distance)
+    # A single distance is returned as a python scalar
+    if np.ndim(circular_distance) == 0:
+        return circular_distance.item()
+    return circular_distance
 
 
 def get_pairs_distance(
@@ -319,11 +330,12 @@ def get_pairs_distance(
         law on each chromosome/arm separately.
     chr_segment_length: list of floats
         List of the size in base pairs of the different arms or chromosomes.
-    xs : list of lists
+    xs : list of numpy.ndarray
         The start coordinate of each bin one array per chromosome or arm.
-    ps : list of lists
-        The sum of contact already count. xs and ps should have the same 
-        dimensions.
+    ps : list of numpy.ndarray
+        The sum of contact already count, preferably as int64 arrays, e.g.
+        ps = [np.zeros(len(x), dtype=np.int64) for x in xs]. xs and ps should
+        have the same dimensions.
     circular : bool
         If True, calculate the distance as the chromosome is circular. Default 
         value is False.
@@ -358,27 +370,290 @@ def get_pairs_distance(
                 # sequence, 5'). For the reads +/+ it's the contrary. We compute
                 # the distance as the distance between the two extremities which
                 # are religated.
-                if line["strand1"] == "-":
-                    distance = abs(
-                        np.array(fragments["start_pos"][int(line["frag1"])])
-                        - np.array(fragments["start_pos"][int(line["frag2"])])
-                    )
                 if line["strand1"] == "+":
-                    distance = abs(
-                        np.array(fragments["end_pos"][int(line["frag1"])])
-                        - np.array(fragments["end_pos"][int(line["frag2"])])
-                    )
+                    extremity = "end_pos"
+                else:
+                    extremity = "start_pos"
+                positions = fragments[extremity].values
+                distance = abs(
+                    positions[int(line["frag1"])] - positions[int(line["frag2"])]
+                )
                 if circular:
                     distance = circular_distance_law(
                         distance, chr_segment_length, chr_bin1
                     )
-                xs_temp = xs[chr_bin1][:]
                 # Find the logbins in which the distance is and add one to the sum
                 # of contact.
-                ps_indice = np.searchsorted(xs_temp, distance, side="right") - 1
+                ps_indice = (
+                    np.searchsorted(xs[chr_bin1], distance, side="right") - 1
+                )
                 ps[chr_bin1][ps_indice] += 1
 
 
+@functools.lru_cache(maxsize=None)
+def _make_logbin_index(base, n_bins):
+    """Build a function finding the logbins in which distances are, without
+    searching in the logbins. The exponent of the base is computed directly
+    with the logarithm and corrected in case of rounding error. The tables
+    and the inverse of the logarithm of the base are computed once for each
+    base and number of bins.
+
+    Parameters
+    ----------
+    base : float
+        Base used to construct the logspace of the bins.
+    n_bins : int
+        Highest exponent of the base in the logbins.
+
+    Returns
+    -------
+    function :
+        Function taking a numpy.ndarray of int64 distances in base pairs and
+        returning the index of the logbin of each distance.
+
+    Examples
+    --------
+    >>> logbin_index = _make_logbin_index(2, 4)
+    >>> logbin_index(np.array([1, 3, 4, 15, 16, 100]))
+    array([0, 1, 2, 3, 4, 4])
+    """
+    inv_log_base = 1 / np.log(base)
+    # The powers of the base truncated to integers, from which the logbins are
+    # built, and the index of the logbin starting at each of them.
+    base_powers = np.power(base, np.arange(n_bins + 1, dtype=np.float64))
+    base_powers = base_powers.astype(np.int64)
+    bin_lut = np.searchsorted(np.unique(base_powers), base_powers)
+
+    def logbin_index(distance):
+        exponent = (np.log(np.maximum(distance, 1)) * inv_log_base).astype(
+            np.int64
+        )
+        np.clip(exponent, 0, n_bins, out=exponent)
+        exponent -= (base_powers[exponent] > distance) & (exponent > 0)
+        exponent += (exponent < n_bins) & (
+            base_powers[np.minimum(exponent + 1, n_bins)] <= distance
+        )
+        return bin_lut[exponent]
+
+    return logbin_index
+
+
+def _accumulate_pairs(
+    strand1,
+    strand2,
+    frag1,
+    frag2,
+    positions,
+    frag_to_chr,
+    logbin_index,
+    offsets,
+    chr_lengths,
+    circular=False,
+):
+    """Count the contacts of a chunk of pairs in each logbin of the distance
+    law. Only the +/+ and -/- pairs with both fragments in the same
+    chromosome/arm are counted, as in get_pairs_distance.
+
+    Parameters
+    ----------
+    strand1, strand2 : numpy.ndarray of int8
+        Strands of the reads 1 and 2, encoded as 1 for "+" and -1 for "-".
+    frag1, frag2 : numpy.ndarray of ints
+        Fragment IDs of the reads 1 and 2.
+    positions : numpy.ndarray of int64
+        Start (first row) and end (second row) positions of the fragments,
+        indexed by fragment ID.
+    frag_to_chr : numpy.ndarray of int32
+        Index of the chromosome/arm bin of each fragment in chr_segment_bins.
+    logbin_index : function
+        Function giving the index of the logbin of each distance, as made by
+        _make_logbin_index.
+    offsets : numpy.ndarray of int64
+        Position of the first logbin of each chromosome/arm in the counts. The
+        last value is the total number of logbins.
+    chr_lengths : numpy.ndarray of int64
+        The size in base pairs of the different arms or chromosomes.
+    circular : bool
+        If True, calculate the distance as the chromosome is circular.
+
+    Returns
+    -------
+    numpy.ndarray of int64 :
+        The number of contacts in each logbin of all the chromosomes/arms.
+    """
+    # We only keep the event +/+ or -/-. See get_pairs_distance.
+    same_strand = strand1 == strand2
+    strand = strand1[same_strand]
+    frag1, frag2 = frag1[same_strand], frag2[same_strand]
+    # Find in which chromosome/arm are the fragment 1 and 2 and only keep the
+    # reads with both fragments in the same chromosome or arm, out of the
+    # removed centromeric regions.
+    chr_bin1 = frag_to_chr[frag1]
+    kept = (chr_bin1 == frag_to_chr[frag2]) & (chr_bin1 % 2 == 0)
+    strand, frag1, frag2 = strand[kept], frag1[kept], frag2[kept]
+    chr_bin = chr_bin1[kept] // 2
+    # Distance between the religated extremities: start positions for the
+    # reads -/- and end positions for the reads +/+.
+    extremity = (strand == 1).view(np.int8)
+    distance = np.abs(
+        positions[extremity, frag1] - positions[extremity, frag2]
+    )
+    if circular:
+        distance = circular_distance_law(distance, chr_lengths, chr_bin)
+    # Find the logbins in which the distances are and add one to the sum of
+    # contacts.
+    ps_indices = logbin_index(distance)
+    # The logbins of a chromosome/arm stop at its length and a null distance
+    # falls into the last logbin, as with list indexing.
+    n_logbins = np.diff(offsets)[chr_bin]
+    ps_indices = np.where(
+        distance == 0, n_logbins - 1, np.minimum(ps_indices, n_logbins - 1)
+    )
+    ps_indices += offsets[chr_bin]
+    return np.bincount(ps_indices, minlength=offsets[-1])
+
+
+def _pairs_cache_path(pairs_reads_file):
+    """Build the path of the binary cache of a pairs file. The pairs file is
+    identified by its path, size and modification time, so that the cache is
+    invalidated whenever it changes without having to read it.
+
+    Parameters
+    ----------
+    pairs_reads_file : str
+        Path of the pairs file.
+
+    Returns
+    -------
+    str :
+        Path to the binary cache file in the user cache directory, shared with
+        the restriction tables cache (see digest._digest_cache_dir).
+    """
+    stat = os.stat(pairs_reads_file)
+    key = "{}:{}:{}".format(
+        os.path.abspath(pairs_reads_file), stat.st_size, stat.st_mtime_ns
+    )
+    return os.path.join(
+        hcd._digest_cache_dir(),
+        "hicstuff_pairs_{}.npybin".format(
+            hashlib.sha256(key.encode()).hexdigest()
+        ),
+    )
+
+
+def _iter_pairs(pairs_reads_file, cache=False):
+    """Read the strands and fragments of a pairs file by chunks of
+    DEFAULT_CHUNK_SIZE pairs. If cache is enabled, they are read from a
+    memory-mapped binary copy of the columns, which is written the first time
+    the text file is read.
+
+    Parameters
+    ----------
+    pairs_reads_file : str
+        Path of a pairs file with the 8th and 9th columns being the ID of the
+        fragments of the reads 1 and 2.
+    cache : bool
+        Whether to use and write the binary cache.
+
+    Yields
+    ------
+    tuple of numpy.ndarray :
+        The strands of reads 1 and 2 encoded as 1 for "+" and -1 for "-", and
+        the fragment IDs of reads 1 and 2.
+    """
+    cache_path = _pairs_cache_path(pairs_reads_file) if cache else None
+    if cache and os.path.exists(cache_path):
+        try:
+            # Only trust cache files written by the current user
+            if (
+                hasattr(os, "getuid")
+                and os.stat(cache_path).st_uid != os.getuid()
+            ):
+                raise ValueError("Pairs cache belongs to another user")
+            if os.path.getsize(cache_path):
+                pairs = np.memmap(
+                    cache_path, dtype=PAIRS_CACHE_DTYPE, mode="r"
+                )
+            else:
+                pairs = np.zeros(0, dtype=PAIRS_CACHE_DTYPE)
+        except (OSError, ValueError) as err:
+            logger.warning("Ignoring pairs cache: %s", err)
+        else:
+            for start in range(0, len(pairs), DEFAULT_CHUNK_SIZE):
+                chunk = pairs[start : start + DEFAULT_CHUNK_SIZE]
+                yield (
+                    chunk["strand1"],
+                    chunk["strand2"],
+                    chunk["frag1"],
+                    chunk["frag2"],
+                )
+            return
+    header_length = len(hio.get_pairs_header(pairs_reads_file))
+    reader = pd.read_csv(
+        pairs_reads_file,
+        sep="\t",
+        header=None,
+        skiprows=header_length,
+        names=[
+            "readID",
+            "chr1",
+            "pos1",
+            "chr2",
+            "pos2",
+            "strand1",
+            "strand2",
+            "frag1",
+            "frag2",
+        ],
+        usecols=["strand1", "strand2", "frag1", "frag2"],
+        dtype={"strand1": str, "strand2": str},
+        chunksize=DEFAULT_CHUNK_SIZE,
+    )
+    # Write to a temporary file first to avoid leaving a truncated cache
+    cache_file = None
+    if cache:
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            # The temporary file is created exclusively, never through an
+            # existing file or link
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            cache_file = os.fdopen(tmp_fd, "wb")
+        except OSError as err:
+            logger.warning("Could not write pairs cache: %s", err)
+    try:
+        for chunk in reader:
+            # Check this is a pairs_idx file and not simple pairs
+            if chunk["frag2"].isnull().any():
+                logger.error(
+                    "Input pairs file must have frag1 and frag2 columns. In "
+                    'hicstuff pipeline, this is the "valid_idx.pairs" file.'
+                )
+                sys.exit(1)
+            pairs = np.empty(len(chunk), dtype=PAIRS_CACHE_DTYPE)
+            pairs["strand1"] = np.where(chunk["strand1"].values == "+", 1, -1)
+            pairs["strand2"] = np.where(chunk["strand2"].values == "+", 1, -1)
+            pairs["frag1"] = chunk["frag1"].values
+            pairs["frag2"] = chunk["frag2"].values
+            if cache_file is not None:
+                pairs.tofile(cache_file)
+            yield (
+                pairs["strand1"],
+                pairs["strand2"],
+                pairs["frag1"],
+                pairs["frag2"],
+            )
+        if cache_file is not None:
+            cache_file.close()
+            os.replace(tmp_path, cache_path)
+            cache_file = None
+    finally:
+        # Discard the partial cache if the file could not be read entirely
+        if cache_file is not None:
+            cache_file.close()
+            os.remove(tmp_path)
+
+
 def get_names(fragments, chr_segment_bins):
     """Make a list of the names of the arms or the chromosomes.
 
@@ -420,6 +695,8 @@ def get_distance_law(
     out_file=None,
     circular=False,
     rm_centro=0,
+    threads=1,
+    cache=False,
 ):
     """Compute distance law as a function of the genomic coordinate aka P(s).
     Bin length increases exponentially with distance. Works on pairs file 
@@ -456,6 +733,16 @@ def get_distance_law(
     rm_centro : int
         If a value is given, will remove the contacts close the centromeres.
         It will remove as many kb as the argument given. Default is None.
+    threads : int
+        Number of threads used to count the contacts of the chunks of pairs in
+        parallel. Default is 1.
+    cache : bool
+        If True, the strands and fragments of the pairs are stored in a binary
+        file of the user cache directory ($XDG_CACHE_HOME/hicstuff or
+        ~/.cache/hicstuff) the first time the pairs file is read, and read
+        from it afterwards. The cache is never removed, so it is only worth
+        enabling for pairs files analysed several times.
+        Default is False.
 
     Returns
     -------
@@ -479,55 +766,71 @@ def get_distance_law(
     # Calculate the length of each chromosoms/arms
     chr_segment_length = get_chr_segment_length(fragments, chr_segment_bins)
     xs = logbins_xs(fragments, chr_segment_length, base, circular)
-    # Create the list of p(s) with one array for each chromosome/arm and each
-    # array contain as many values as in the logbin
-    ps = [None] * len(chr_segment_length)
-    for i in range(len(xs)):
-        ps[i] = [0] * len(xs[i])
-    # Read the pair reads file
-    with open(pairs_reads_file, "r", newline="") as reads:
-        # Remove the line of the header
-        header_length = len(hio.get_pairs_header(pairs_reads_file))
-        for i in range(header_length):
-            next(reads)
-        # Reads all the others lines and put the values in a dictionnary with
-        # the keys : 'readID', 'chr1', 'pos1', 'chr2', 'pos2', 'strand1',
-        # 'strand2', 'frag1', 'frag2'
-        reader = csv.DictReader(
-            reads,
-            fieldnames=[
-                "readID",
-                "chr1",
-                "pos1",
-                "chr2",
-                "pos2",
-                "strand1",
-                "strand2",
-                "frag1",
-                "frag2",
-            ],
-            delimiter="\t",
+    # Lookup table giving the chromosome/arm bin of each fragment. Fragments
+    # after the last segment fall in an odd bin and are discarded.
+    frag_to_chr = np.full(len(fragments), len(chr_segment_bins) - 1, np.int32)
+    for i in range(len(chr_segment_bins) - 1):
+        frag_to_chr[
+            int(chr_segment_bins[i]) : int(chr_segment_bins[i + 1])
+        ] = i
+    # The counts of all chromosomes/arms are stored in a single flat array,
+    # each chromosome/arm starting at its offset in the array.
+    offsets = np.cumsum([0] + [len(x) for x in xs])
+    # The logbins of all chromosomes/arms are built from the same powers of
+    # the base, which are used to find the logbin of a distance directly.
+    n_bins = int(np.log(max(chr_segment_length)) / np.log(base)) + 1
+    logbin_index = _make_logbin_index(base, n_bins)
+    counts = np.zeros(offsets[-1], dtype=np.int64)
+    positions = np.stack(
+        (
+            fragments["start_pos"].to_numpy(dtype=np.int64),
+            fragments["end_pos"].to_numpy(dtype=np.int64),
         )
-        for line in reader:
-            # Iterate in each line of the file after the header
-            get_pairs_distance(
-                line, fragments, chr_segment_bins, chr_segment_length, xs, ps, circular
+    )
+    chr_lengths = np.array(chr_segment_length, dtype=np.int64)
+    # Chunks are parsed in the main thread while the previous ones are
+    # counted by the workers, with at most two chunks per worker in memory.
+    pool = ThreadPoolExecutor(max_workers=threads)
+    pending = collections.deque()
+    try:
+        for strand1, strand2, frag1, frag2 in _iter_pairs(
+            pairs_reads_file, cache
+        ):
+            pending.append(
+                pool.submit(
+                    _accumulate_pairs,
+                    strand1,
+                    strand2,
+                    frag1,
+                    frag2,
+                    positions,
+                    frag_to_chr,
+                    logbin_index,
+                    offsets,
+                    chr_lengths,
+                    circular,
+                )
             )
+            if len(pending) >= 2 * threads:
+                counts += pending.popleft().result()
+        while pending:
+            counts += pending.popleft().result()
+    finally:
+        pool.shutdown()
+    # Create the list of p(s) with one array for each chromosome/arm and each
+    # array contain as many values as in the logbin. The arrays are views on a
+    # single contiguous array.
+    ps_flat = counts.astype(np.float64)
+    ps = [ps_flat[offsets[i] : offsets[i + 1]] for i in range(len(xs))]
     # Divide the number of contacts by the area of the logbin
     for i in range(len(xs)):
         n = chr_segment_length[i]
-        for j in range(len(xs[i]) - 1):
-            # Use the area of a trapezium to know the area of the logbin with n
-            # the size of the matrix.
-            ps[i][j] /= ((2 * n - xs[i][j + 1] - xs[i][j]) / 2) * (
-                (1 / np.sqrt(2)) * (xs[i][j + 1] - xs[i][j])
-            )
-            # print(
-            #    ((2 * n - xs[i][j + 1] - xs[i][j]) / 2)
-            #    * ((1 / np.sqrt(2)) * (xs[i][j + 1] - xs[i][j]))
-            # )
+        # Use the area of a trapezium to know the area of the logbins with n
+        # the size of the matrix.
+        ps[i][:-1] /= ((2 * n - xs[i][1:] - xs[i][:-1]) / 2) * (
+            (1 / np.sqrt(2)) * (xs[i][1:] - xs[i][:-1])
+        )
         # Case of the last logbin which is an isosceles rectangle triangle
-        # print(ps[i][-5:-1], ((n - xs[i][-1]) ** 2) / 2)
         ps[i][-1] /= ((n - xs[i][-1]) ** 2) / 2
     names = get_names(fragments, chr_segment_bins)
     if out_file:
@@ -567,15 +870,13 @@ def normalize_distance_law(xs, ps, inf=3000):
     normed_ps = [None] * len(ps)
     for j, my_list in enumerate(ps):
         # Iterate on the different ps to normalize each of theme separately
-        sum_values = 0
         # Change the last value to have something continuous because the last
         # one is much bigger.
         my_list[-1] = my_list[-2]
-        for i, value in enumerate(my_list):
-            # Keep only the value between 1kb and the length of the shorter
-            # object given in the list
-            if (xs[j][i] > inf) and (i < min_xs):
-                sum_values += value
+        # Keep only the value between inf and the length of the shorter object
+        # given in the list
+        values = np.asarray(my_list[:min_xs], dtype=np.float64)
+        sum_values = values[np.asarray(xs[j][:min_xs]) > inf].sum()
         if sum_values == 0:
             sum_values += 1
             logger.warning("No values of p(s) in one segment")
@@ -661,12 +962,12 @@ def slope_distance_law(xs, ps):
     for i in range(len(ps)):
         ps[i][ps[i] == 0] = 10 ** (-9)
         # Compute the slope
-        slope_temp = np.log(np.array(ps[i][1:]) / np.array(ps[i][:-1])) / np.log(
-            np.array(xs[i][1:]) / np.array(xs[i][:-1])
-        )
+        log_ps = np.log(np.asarray(ps[i], dtype=np.float64))
+        log_xs = np.log(np.asarray(xs[i], dtype=np.float64))
+        slope_temp = np.diff(log_ps) / np.diff(log_xs)
+        slope_temp[np.isnan(slope_temp)] = 10 ** (-15)
         # The 1.8 is the intensity of the normalisation, it could be adapted.
-        slope_temp[slope_temp == np.nan] = 10 ** (-15)
-        slope[i] = ndimage.filters.gaussian_filter1d(slope_temp, 1.8)
+        slope[i] = ndimage.gaussian_filter1d(slope_temp, 1.8)
     return slope
 
 
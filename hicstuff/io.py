@@ -10,7 +10,6 @@ import functools
 import sys
 import numpy as np
 import pandas as pd
-import collections
 import subprocess as sp
 import pathlib
 import re
@@ -28,6 +27,10 @@ DEFAULT_MAX_MATRIX_SHAPE = 10000
 DEFAULT_FRAGMENTS_LIST_FILE_NAME = "fragments_list.txt"
 DEFAULT_INFO_CONTIGS_FILE_NAME = "info_contigs.txt"
 DEFAULT_SPARSE_MATRIX_FILE_NAME = "abs_fragments_contacts_weighted.txt"
+# Size of the write buffer used for large tabular outputs, in bytes
+DEFAULT_WRITE_BUFFER_SIZE = 2 ** 20
+# Size of the read buffer used to stream large tabular inputs, in bytes
+DEFAULT_READ_BUFFER_SIZE = 2 ** 20
 
 
 def _cols_to_sparse(sparse_array, shape=None, dtype=np.float64):
@@ -196,6 +199,38 @@ def load_pos_col(path, colnum, header=1, dtype=np.int64):
     return pos_arr
 
 
+def count_lines(path):
+    """
+    Count the lines of a text file by scanning its raw bytes by blocks, which
+    is much faster than iterating over the lines in python. A last line
+    without a trailing newline is counted as well.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+
+    Returns
+    -------
+    int :
+        The number of lines in the file.
+
+    Examples
+    --------
+    >>> count_lines('test_data/fragments_list.txt')
+    565
+    """
+    n_lines = 0
+    last_block = b""
+    with open(path, "rb", buffering=0) as handle:
+        for block in iter(lambda: handle.read(DEFAULT_READ_BUFFER_SIZE), b""):
+            n_lines += block.count(b"\n")
+            last_block = block
+    if last_block and not last_block.endswith(b"\n"):
+        n_lines += 1
+    return n_lines
+
+
 def generate_temp_dir(path):
     """Temporary directory generation
 
@@ -647,17 +682,29 @@ def dade_to_graal(
     and contact information all files are generated at the same time.
     """
 
-    with open(output_matrix, "w") as sparse_file:
-        sparse_file.write("id_frag_a\tid_frag_b\tn_contact")
-        with open(filename) as file_handle:
-            first_line = file_handle.readline()
-            for row_index, line in enumerate(file_handle):
-                dense_row = np.array(line.split("\t")[1:], dtype=np.int32)
-                for col_index in np.nonzero(dense_row)[0]:
-                    line_to_write = "{}\t{}\t{}\n".format(
-                        row_index, col_index, dense_row[col_index]
-                    )
-                    sparse_file.write(line_to_write)
+    with open(filename) as file_handle:
+        first_line = file_handle.readline()
+
+    with open(
+        output_matrix, "wb", buffering=DEFAULT_WRITE_BUFFER_SIZE
+    ) as sparse_file:
+        sparse_file.write(b"id_frag_a\tid_frag_b\tn_contact\n")
+        # Sparsify the dense matrix by blocks of rows to bound memory usage
+        row_offset = 0
+        for chunk in pd.read_csv(
+            filename, sep="\t", header=None, skiprows=1, chunksize=10000
+        ):
+            dense_rows = chunk.iloc[:, 1:].values.astype(np.int32)
+            rows, cols = np.nonzero(dense_rows)
+            np.savetxt(
+                sparse_file,
+                np.column_stack(
+                    [rows + row_offset, cols, dense_rows[rows, cols]]
+                ),
+                fmt="%d",
+                delimiter="\t",
+            )
+            row_offset += dense_rows.shape[0]
 
     header = first_line.split("\t")
     bin_type = header[0]
@@ -693,44 +740,58 @@ def dade_to_graal(
     frag_ends = frag_ends.astype(np.int32) - 1
     frag_lengths = frag_ends - frag_starts
 
-    total_length = len(global_frag_ids)
-
-    with open(output_contigs, "w") as info_contigs:
-
-        info_contigs.write("contig\tlength\tn_frags\tcumul_length\n")
-
-        cumul_length = 0
-
-        for contig in collections.OrderedDict.fromkeys(contig_names):
-
-            length_tig = np.sum(frag_lengths[contig_names == contig])
-            n_frags = collections.Counter(contig_names)[contig]
-            line_to_write = "%s\t%s\t%s\t%s\n" % (
-                contig,
-                length_tig,
-                n_frags,
-                cumul_length,
-            )
-            info_contigs.write(line_to_write)
-            cumul_length += n_frags
+    # Number of fragments, total length and cumulative number of fragments of
+    # each contig, in order of appearance
+    contigs, first_frags, contig_idx, n_frags = np.unique(
+        contig_names,
+        return_index=True,
+        return_inverse=True,
+        return_counts=True,
+    )
+    length_tigs = np.bincount(contig_idx, weights=frag_lengths)
+    length_tigs = length_tigs.astype(np.int64)
+    order = np.argsort(first_frags)
+    contigs, length_tigs, n_frags = (
+        contigs[order],
+        length_tigs[order],
+        n_frags[order],
+    )
+    cumul_lengths = np.cumsum(n_frags) - n_frags
+
+    with open(output_contigs, "wb") as info_contigs:
+
+        info_contigs.write(b"contig\tlength\tn_frags\tcumul_length\n")
+        info_contigs.write(
+            "".join(
+                "%s\t%d\t%d\t%d\n" % contig_info
+                for contig_info in zip(
+                    contigs.tolist(),
+                    length_tigs.tolist(),
+                    n_frags.tolist(),
+                    cumul_lengths.tolist(),
+                )
+            ).encode()
+        )
 
-    with open(output_frags, "w") as fragments_list:
+    with open(
+        output_frags, "wb", buffering=DEFAULT_WRITE_BUFFER_SIZE
+    ) as fragments_list:
 
         fragments_list.write(
-            "id\tchrom\tstart_pos\tend_pos" "\tsize\tgc_content\n"
+            b"id\tchrom\tstart_pos\tend_pos" b"\tsize\tgc_content\n"
         )
         bogus_gc = 0.5
 
-        for i in range(total_length):
-            line_to_write = "%s\t%s\t%s\t%s\t%s\t%s\n" % (
-                int(local_frag_ids[i]) + 1,
-                contig_names[i],
-                frag_starts[i],
-                frag_ends[i],
-                frag_lengths[i],
-                bogus_gc,
+        fragments_list.writelines(
+            ("%d\t%s\t%d\t%d\t%d\t%s\n" % (*frag_info, bogus_gc)).encode()
+            for frag_info in zip(
+                (local_frag_ids.astype(np.int64) + 1).tolist(),
+                contig_names.tolist(),
+                frag_starts.tolist(),
+                frag_ends.tolist(),
+                frag_lengths.tolist(),
             )
-            fragments_list.write(line_to_write)
+        )
 
 
 def load_bedgraph2d(filename, bin_size=None, fragments_file=None):
@@ -789,13 +850,17 @@ def load_bedgraph2d(filename, bin_size=None, fragments_file=None):
     ordered_frag_pos = (
         pd.DataFrame(frag_pos).drop_duplicates().reset_index(drop=True)
     )
-    frag_pos_a = bed2d[[0, 1]].apply(lambda x: tuple(x), axis=1)
-    frag_pos_b = bed2d[[3, 4]].apply(lambda x: tuple(x), axis=1)
+    frag_pos_a = list(zip(bed2d[0], bed2d[1]))
+    frag_pos_b = list(zip(bed2d[3], bed2d[4]))
     # If fragments file is provided, use fragments positions to indices mapping
     if fragments_file is not None:
         frags = pd.read_csv(fragments_file, delimiter="\t")
-        frag_map = frags.apply(lambda x: (str(x.chrom), x.start_pos), axis=1)
-        frag_map = {f_name: f_idx for f_idx, f_name in enumerate(frag_map)}
+        frag_map = dict(
+            zip(
+                zip(frags.chrom.astype(str), frags.start_pos),
+                range(frags.shape[0]),
+            )
+        )
     # If fixed fragment size available, use it to reconstruct original
     # fragments ID (even if they are absent from the bedgraph file).
     elif bin_size is not None:
@@ -1077,7 +1142,15 @@ def save_bedgraph2d(mat, frags, out_path):
     bg2.to_csv(out_path, header=None, index=False, sep="\t")
 
 
-def sort_pairs(in_file, out_file, keys, tmp_dir=None, threads=1, buffer="2G"):
+def sort_pairs(
+    in_file,
+    out_file,
+    keys,
+    tmp_dir=None,
+    threads=1,
+    buffer="2G",
+    columns=None,
+):
     """
     Sort a pairs file in batches using UNIX sort.
 
@@ -1098,6 +1171,11 @@ def sort_pairs(in_file, out_file, keys, tmp_dir=None, threads=1, buffer="2G"):
         Number of parallel sorting threads.
     buffer : str
         Buffer size used for sorting. Consists of a number and a unit.
+    columns : list of str, optional
+        Subset of columns to keep in the output file, with the same names as
+        keys. Other columns are dropped before sorting, so that fewer bytes
+        are sorted and written. Kept columns remain in file order. All
+        columns are kept by default. Keys must be included in the columns.
     """
     # TODO: Write a pure python implementation to drop GNU coreutils depencency,
     # could be inspired from: https://stackoverflow.com/q/14465154/8440675
@@ -1131,21 +1209,34 @@ def sort_pairs(in_file, out_file, keys, tmp_dir=None, threads=1, buffer="2G"):
         )
         parallel_ok = False
 
+    # Sort type of each column of the pairs file, in file order
+    col_types = {
+        "readID": "d",
+        "chr1": "V",
+        "pos1": "n",
+        "chr2": "V",
+        "pos2": "n",
+        "strand1": "d",
+        "strand2": "d",
+        "frag1": "n",
+        "frag2": "n",
+    }
+    all_columns = list(col_types)
+    # Kept columns are always written in file order
+    if columns is None:
+        columns = all_columns
+    else:
+        columns = [col for col in all_columns if col in columns]
+    # Column numbers in the sorted output, after dropping columns
     key_map = {
-        "readID": "-k1,1d",
-        "chr1": "-k2,2V",
-        "pos1": "-k3,3n",
-        "chr2": "-k4,4V",
-        "pos2": "-k5,5n",
-        "strand1": "-k6,6d",
-        "strand2": "-k7,7d",
-        "frag1": "-k8,8n",
-        "frag2": "-k9,9n",
+        col: "-k{0},{0}{1}".format(rank + 1, col_types[col])
+        for rank, col in enumerate(columns)
+        if col in col_types
     }
 
     # transform column names to corresponding sort keys
     try:
-        sort_keys = map(lambda k: key_map[k], keys)
+        sort_keys = [key_map[k] for k in keys]
     except KeyError:
         print("Unkown column name.")
         raise
@@ -1155,18 +1246,40 @@ def sort_pairs(in_file, out_file, keys, tmp_dir=None, threads=1, buffer="2G"):
         for line in header:
             if line.startswith("#sorted"):
                 output.write("#sorted: {0}\n".format("-".join(keys)))
+            elif line.startswith("#columns") and columns != all_columns:
+                output.write("#columns: {0}\n".format(" ".join(columns)))
             else:
                 output.write(line + "\n")
 
-    # Sort pairs and append to file.
+    # Sort pairs and append to file. The C locale makes comparisons bytewise,
+    # which is much faster than locale-aware collation and does not depend
+    # on the user's environment.
+    sort_env = dict(os.environ, LC_ALL="C")
     with open(out_file, "a") as output:
-        grep_proc = sp.Popen(["grep", "-v", "^#", in_file], stdout=sp.PIPE)
-        sort_cmd = ["sort", "-S %s" % buffer] + list(sort_keys)
+        grep_proc = sp.Popen(
+            ["grep", "-v", "^#", in_file], stdout=sp.PIPE, env=sort_env
+        )
+        sort_input = grep_proc.stdout
+        if columns != all_columns:
+            cut_proc = sp.Popen(
+                [
+                    "cut",
+                    "-f",
+                    ",".join(str(all_columns.index(c) + 1) for c in columns),
+                ],
+                stdin=sort_input,
+                stdout=sp.PIPE,
+                env=sort_env,
+            )
+            sort_input = cut_proc.stdout
+        sort_cmd = ["sort", "-S %s" % buffer] + sort_keys
         if tmp_dir is not None:
             sort_cmd.append("--temporary-directory={0}".format(tmp_dir))
         if parallel_ok:
             sort_cmd.append("--parallel={0}".format(threads))
-        sort_proc = sp.Popen(sort_cmd, stdin=grep_proc.stdout, stdout=output)
+        sort_proc = sp.Popen(
+            sort_cmd, stdin=sort_input, stdout=output, env=sort_env
+        )
         sort_proc.communicate()
 
 
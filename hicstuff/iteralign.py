@@ -165,8 +165,11 @@ def iterative_align(
             raise ValueError("Unknown aligner. Select bowtie2, minimap2 or bwa.")
 
         map_process = sp.Popen(cmd, shell=True, stdout=sp.PIPE)
+        # Temporary alignments are read back at once: skip BAM compression
         sort_process = sp.Popen(
-            "samtools sort -n -@ {cpus} -O BAM -o {bam}".format(**map_args),
+            "samtools sort -n -l 0 -@ {cpus} -O BAM -o {bam}".format(
+                **map_args
+            ),
             shell=True,
             stdin=map_process.stdout,
         )
@@ -207,7 +210,7 @@ def iterative_align(
     map_process = sp.Popen(cmd, shell=True, stdout=sp.PIPE)
     # Keep reads sorted by name
     sort_process = sp.Popen(
-        "samtools sort -n -@ {cpus} -O BAM -o {bam}".format(
+        "samtools sort -n -l 0 -@ {cpus} -O BAM -o {bam}".format(
             cpus=n_cpu, bam=temp_alignment
         ),
         shell=True,
@@ -220,7 +223,7 @@ def iterative_align(
     # Report unaligned reads as well
     iter_out += [join(tmp_dir, "unaligned.bam")]
     temp_bam = ps.AlignmentFile(temp_alignment, "rb", check_sq=False)
-    unmapped = ps.AlignmentFile(iter_out[-1], "wb", template=temp_bam)
+    unmapped = ps.AlignmentFile(iter_out[-1], "wb0", template=temp_bam)
     for r in temp_bam:
         # Do not write supplementary alignments (keeping 1 alignment/read)
         if r.query_name in remaining_reads and not r.is_supplementary:
@@ -303,7 +306,8 @@ def filter_bamfile(temp_alignment, filtered_out, min_qual=30):
 
     unaligned = set()
     temp_bam = ps.AlignmentFile(temp_alignment, "rb", check_sq=False)
-    outf = ps.AlignmentFile(filtered_out, "wb", template=temp_bam)
+    # Filtered alignments are only merged later, write uncompressed BAM
+    outf = ps.AlignmentFile(filtered_out, "wb0", template=temp_bam)
     for r in temp_bam:
         if r.flag in [0, 16] and r.mapping_quality >= min_qual:
             outf.write(r)
@@ -2,7 +2,9 @@
 Handle generation of graal-compatible contact maps from fastq files.
 cmdoret, 20190322
 """
-import os, time, csv, sys, re
+import os, io, time, sys, re
+import collections
+import contextlib
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import shutil as st
@@ -11,6 +13,7 @@ from shutil import which
 import logging
 from os.path import join
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
 from Bio import SeqIO
 import pandas as pd
 import numpy as np
@@ -26,6 +29,13 @@ from hicstuff.version import __version__
 import hicstuff.log as hcl
 from hicstuff.log import logger
 
+# Number of alignments read at once from each BAM file when making pairs
+DEFAULT_BAM_BATCH_SIZE = 1000000
+# Size in bytes of the blocks of pairs counted in parallel to build the matrix
+DEFAULT_PAIRS_BLOCK_SIZE = 2 ** 26
+# SAM flag bit set when a read is aligned on the reverse strand
+BAM_FREVERSE = 16
+
 
 def align_reads(
     reads,
@@ -49,7 +59,7 @@ def align_reads(
         Path to the fastq file with Hi-C reads.
     genome : str
         Path to the genome bowtie2/bwa index prefix if using bowtie2 or bwa, or to the 
-        fasta if using minimap2.
+        fasta or its .mmi index if using minimap2.
     out_bam : str
         Path to the output BAM file containing mapped Hi-C reads.
     tmp_dir : str
@@ -71,9 +81,9 @@ def align_reads(
     """
     if tmp_dir is None:
         tmp_dir = os.getcwd()
-    tmp_bam = out_bam + ".tmp"
 
     if iterative:
+        tmp_bam = out_bam + ".tmp"
         iter_tmp_dir = hio.generate_temp_dir(tmp_dir)
         hci.iterative_align(
             reads,
@@ -92,36 +102,174 @@ def align_reads(
             ),
             shell=True,
         )
+        os.remove(tmp_bam)
     else:
         if aligner == "minimap2":
-            map_cmd = "minimap2 -2 -t {threads} -ax sr {fasta} {fastq} > {sam}"
+            map_cmd = (
+                "minimap2 -2 -t {threads} -ax sr --secondary=no "
+                "{fasta} {fastq}"
+            )
         elif aligner == "bwa":
-            map_cmd = "bwa mem -t {threads} -v 1 {index} {fastq} > {sam}"
+            map_cmd = "bwa mem -t {threads} -v 1 {index} {fastq}"
         else:
-            map_cmd = "bowtie2 --very-sensitive-local -p {threads} -x {index} -U {fastq} > {sam}"
+            map_cmd = "bowtie2 --very-sensitive-local -p {threads} -x {index} -U {fastq}"
         map_args = {
             "threads": threads,
-            "sam": tmp_bam,
             "fastq": reads,
             "fasta": genome,
             "index": genome,
         }
-        sp.call(map_cmd.format(**map_args), shell=True)
-        # Remove supplementary alignments and sort reads by name
-        sp.call("samtools view -F 2048 -h -@ {threads} {tmp} | samtools sort -n -@ {threads} -o {out} -".format(
-                tmp=tmp_bam, threads=threads, out=out_bam
-            ),
-            shell=True,
+        # Stream alignments directly into samtools to remove supplementary
+        # alignments and sort reads by name, without an intermediate SAM file.
+        # Uncompressed BAM is passed to the sort to avoid re-parsing text.
+        map_process = sp.Popen(
+            map_cmd.format(**map_args), shell=True, stdout=sp.PIPE
         )
-    os.remove(tmp_bam)
+        sort_cmd = (
+            "samtools view -F 2048 -u -@ {threads} - | "
+            "samtools sort -n -@ {threads} -o {out} -"
+        ).format(threads=threads, out=out_bam)
+        sort_process = sp.Popen(sort_cmd, shell=True, stdin=map_process.stdout)
+        # Allow the aligner to receive a SIGPIPE if samtools exits early
+        map_process.stdout.close()
+        sort_process.communicate()
+        map_process.wait()
+        for process, cmd in [
+            (map_process, map_cmd.format(**map_args)),
+            (sort_process, sort_cmd),
+        ]:
+            if process.returncode != 0:
+                raise sp.CalledProcessError(process.returncode, cmd)
+
+
+def _iter_bam_batches(bam, batch_size=DEFAULT_BAM_BATCH_SIZE):
+    """
+    Read the alignments of a BAM file by batches, in file order.
+
+    Parameters
+    ----------
+    bam : str
+        Path to the BAM file.
+    batch_size : int
+        Number of alignments per batch.
+
+    Yields
+    ------
+    pandas.DataFrame :
+        One row per alignment with columns name (read identifier), mapq,
+        chrom (reference index, -1 if unmapped), pos (0-based start) and
+        reverse (whether the read is on the reverse strand). Coordinates are
+        stored as int32, like in the BAM format.
+    """
+    with ps.AlignmentFile(bam, "rb") as alignments:
+        alignments = alignments.fetch(until_eof=True)
+        # An empty file still yields an empty batch
+        batch = list(itertools.islice(alignments, batch_size))
+        while True:
+            n_aln = len(batch)
+            # Strand is taken from the raw flags of the whole batch at once
+            flags = np.fromiter((aln.flag for aln in batch), np.int32, n_aln)
+            yield pd.DataFrame(
+                {
+                    "name": [aln.query_name for aln in batch],
+                    "mapq": np.fromiter(
+                        (aln.mapping_quality for aln in batch), np.int16, n_aln
+                    ),
+                    "chrom": np.fromiter(
+                        (aln.reference_id for aln in batch), np.int32, n_aln
+                    ),
+                    "pos": np.fromiter(
+                        (aln.reference_start for aln in batch), np.int32, n_aln
+                    ),
+                    "reverse": (flags & BAM_FREVERSE) != 0,
+                }
+            )
+            batch = list(itertools.islice(alignments, batch_size))
+            if not batch:
+                break
+
+
+def _match_mates(end1, end2):
+    """
+    Match the reads of two name-sorted tables of alignments by read
+    identifier. Unmatched reads following the last matched read of their
+    table may still have a mate in the next batch and are returned
+    separately. Only the first alignment of each read is used.
+
+    Parameters
+    ----------
+    end1 : pandas.DataFrame
+        Alignments of the forward reads, as yielded by _iter_bam_batches.
+    end2 : pandas.DataFrame
+        Alignments of the reverse reads, as yielded by _iter_bam_batches.
+
+    Returns
+    -------
+    pairs : pandas.DataFrame
+        Matched reads, in the order of end1, with columns suffixed by 1 and 2
+        for each end.
+    pending1 : pandas.DataFrame
+        Unmatched forward reads which may have a mate in the next batch.
+    pending2 : pandas.DataFrame
+        Unmatched reverse reads which may have a mate in the next batch.
+    n_unmatched : int
+        Number of reads which cannot have a mate anymore.
+    """
+    # Read names are converted once to integer codes shared by both ends, so
+    # that reads are matched by comparing integers instead of strings.
+    names = np.concatenate([end1.name.values, end2.name.values])
+    codes = pd.factorize(names)[0]
+    n_codes = codes.max() + 1 if len(codes) else 0
+    codes = (codes[: len(end1)], codes[len(end1) :])
+    # Row of the first alignment of each read in each end, -1 if absent
+    first_row = []
+    for code in codes:
+        rows = np.full(n_codes, -1, dtype=np.int64)
+        first = np.unique(code, return_index=True)[1]
+        rows[code[first]] = first
+        first_row.append(rows)
+    n_unmatched = 0
+    pending, matched = [], []
+    for end, code, own_rows, other_rows in (
+        (end1, codes[0], first_row[0], first_row[1]),
+        (end2, codes[1], first_row[1], first_row[0]),
+    ):
+        is_first = own_rows[code] == np.arange(len(code))
+        has_mate = is_first & (other_rows[code] >= 0)
+        # Reads before the last matched read would have been matched already
+        last_match = np.flatnonzero(has_mate)[-1] if has_mate.any() else -1
+        pending_mask = is_first & ~has_mate
+        pending_mask[: last_match + 1] = False
+        n_unmatched += len(end) - has_mate.sum() - pending_mask.sum()
+        pending.append(end[pending_mask])
+        matched.append(has_mate)
+    # Gather the mates of the matched forward reads, in the order of end1
+    mates = end2.iloc[first_row[1][codes[0][matched[0]]]]
+    pairs = end1[matched[0]].reset_index(drop=True).join(
+        mates.drop(columns="name").reset_index(drop=True),
+        lsuffix="1",
+        rsuffix="2",
+    )
+    return pairs, pending[0], pending[1], n_unmatched
 
 
-def bam2pairs(bam1, bam2, out_pairs, info_contigs, min_qual=30):
+def bam2pairs(
+    bam1,
+    bam2,
+    out_pairs,
+    info_contigs,
+    min_qual=30,
+    restriction_table=None,
+    out_pairs_idx=None,
+):
     """
     Make a .pairs file from two Hi-C bam files sorted by read names.
     The Hi-C mates are matched by read identifier. Pairs where at least one
     reads maps with MAPQ below  min_qual threshold are discarded. Pairs are
     sorted by readID and stored in upper triangle (first pair higher).
+    Optionally, the indexed pairs file with restriction fragments of each
+    read is written in the same pass, in which case writing the plain pairs
+    file can be skipped.
 
     Parameters
     ----------
@@ -129,99 +277,159 @@ def bam2pairs(bam1, bam2, out_pairs, info_contigs, min_qual=30):
         Path to the name-sorted BAM file with aligned Hi-C forward reads.
     bam2 : str
         Path to the name-sorted BAM file with aligned Hi-C reverse reads.
-    out_pairs : str
+    out_pairs : str or None
         Path to the output space-separated .pairs file with columns 
-        readID, chr1 pos1 chr2 pos2 strand1 strand2
+        readID, chr1 pos1 chr2 pos2 strand1 strand2. Can be None if only
+        out_pairs_idx is needed.
     info_contigs : str
         Path to the info contigs file, to get info on chromosome sizes and order.
     min_qual : int
         Minimum mapping quality required to keep a Hi-C pair.
+    restriction_table : dict, optional
+        Dictionary with chromosome identifiers (str) as keys and list of
+        positions (int) of restriction sites as values. Required to write
+        out_pairs_idx.
+    out_pairs_idx : str, optional
+        Path to the output indexed pairs file, with frag1 and frag2 columns
+        added as in digest.attribute_fragments. Not written by default.
     """
-    forward = ps.AlignmentFile(bam1, "rb")
-    reverse = ps.AlignmentFile(bam2, "rb")
+    # Reference ids of both files are decoded with the same names, so both
+    # headers must list the same references in the same order
+    with ps.AlignmentFile(bam1, "rb") as forward, ps.AlignmentFile(
+        bam2, "rb"
+    ) as reverse:
+        if (forward.references, forward.lengths) != (
+            reverse.references,
+            reverse.lengths,
+        ):
+            raise ValueError(
+                "Both BAM files must be aligned on the same references, in "
+                "the same order."
+            )
+        # Names of the references, unmapped reads having an empty name
+        chrom_names = np.array(list(forward.references) + [""], dtype=object)
 
     # Generate header lines
     format_version = "## pairs format v1.0\n"
     sorting = "#sorted: readID\n"
     cols = "#columns: readID chr1 pos1 chr2 pos2 strand1 strand2\n"
-    # Chromosome order will be identical in info_contigs and pair files
-    chroms = pd.read_csv(info_contigs, sep="\t").apply(
-        lambda x: "#chromsize: %s %d\n" % (x.contig, x.length), axis=1
-    )
-    with open(out_pairs, "w") as pairs:
-        pairs.writelines([format_version, sorting, cols] + chroms.tolist())
-        pairs_writer = csv.writer(pairs, delimiter="\t")
+    # Chromosome order will be identical in info_contigs and pair files.
+    # Contig names and lengths are the first two columns.
+    with open(info_contigs) as contigs_file:
+        next(contigs_file)
+        contigs = [
+            line.split("\t", 2)[:2] for line in contigs_file if line.strip()
+        ]
+    contig_order = [contig for contig, _ in contigs]
+    chroms = [
+        "#chromsize: %s %d\n" % (contig, int(length))
+        for contig, length in contigs
+    ]
+    if out_pairs is None and out_pairs_idx is None:
+        raise ValueError("At least one output pairs file is required.")
+    if out_pairs_idx is not None:
+        if restriction_table is None:
+            raise ValueError(
+                "A restriction table is required to write indexed pairs."
+            )
+        # Fragment indices are genome-based, in the order of info_contigs
+        sites, offsets = hcd.flatten_restriction_table(
+            restriction_table, contig_order
+        )
+        # Rank of each reference in info_contigs, -1 for references missing
+        # from it and for unmapped reads
+        contig_ranks = {
+            contig: rank for rank, contig in enumerate(contig_order)
+        }
+        chrom_ranks = np.array(
+            [contig_ranks.get(chrom, -1) for chrom in chrom_names], np.int64
+        )
+    missing_contigs = set()
+    with contextlib.ExitStack() as stack:
+        if out_pairs is not None:
+            pairs = stack.enter_context(open(out_pairs, "w"))
+        if out_pairs_idx is not None:
+            idx_pairs = stack.enter_context(open(out_pairs_idx, "w"))
+        # Header lines are joined in a single write
+        chroms = "".join(chroms)
+        if out_pairs is not None:
+            pairs.write(format_version + sorting + cols + chroms)
+        if out_pairs_idx is not None:
+            idx_cols = cols.rstrip() + " frag1 frag2\n"
+            idx_pairs.write(format_version + sorting + idx_cols + chroms)
         n_reads = {"total": 0, "mapped": 0}
         # Remember if some read IDs were missing from either file
         unmatched_reads = 0
-        # Remember if all reads in one bam file have been read
-        exhausted = [False, False]
-        # Iterate on both BAM simultaneously
-        for end1, end2 in itertools.zip_longest(forward, reverse):
-            # Both file still have reads
-            # Check if reads pass filter
-            try:
-                end1_passed = end1.mapping_quality >= min_qual
-            # Happens if end1 bam file has been exhausted
-            except AttributeError:
-                exhausted[0] = True
-                end1_passed = False
-            try:
-                end2_passed = end2.mapping_quality >= min_qual
-            # Happens if end2 bam file has been exhausted
-            except AttributeError:
-                exhausted[1] = True
-                end2_passed = False
-            # Skip read if mate is not present until they match or reads
-            # have been exhausted
-            while sum(exhausted) == 0 and end1.query_name != end2.query_name:
-                # Get next read and check filters again
-                # Count single-read iteration
-                unmatched_reads += 1
-                n_reads["total"] += 1
-                if end1.query_name < end2.query_name:
-                    try:
-                        end1 = next(forward)
-                        end1_passed = end1.mapping_quality >= min_qual
-                    # If EOF is reached in BAM 1
-                    except (StopIteration, AttributeError):
-                        exhausted[0] = True
-                        end1_passed = False
-                    n_reads["mapped"] += end1_passed
-                elif end1.query_name > end2.query_name:
-                    try:
-                        end2 = next(reverse)
-                        end2_passed = end2.mapping_quality >= min_qual
-                    # If EOF is reached in BAM 2
-                    except (StopIteration, AttributeError):
-                        exhausted[1] = True
-                        end2_passed = False
-                    n_reads["mapped"] += end2_passed
-
-            # 2 reads processed per iteration, unless one file is exhausted
-            n_reads["total"] += 2 - sum(exhausted)
-            n_reads["mapped"] += sum([end1_passed, end2_passed])
+        # Reads waiting for their mate in the next batch of the other file
+        pending1 = pending2 = None
+        # Iterate on batches of both BAM simultaneously
+        for batch1, batch2 in itertools.zip_longest(
+            _iter_bam_batches(bam1), _iter_bam_batches(bam2)
+        ):
+            for batch in (batch1, batch2):
+                if batch is not None:
+                    n_reads["total"] += len(batch)
+                    n_reads["mapped"] += (batch.mapq >= min_qual).sum()
+            end1 = pd.concat([pending1, batch1])
+            end2 = pd.concat([pending2, batch2])
+            matched, pending1, pending2, n_unmatched = _match_mates(end1, end2)
+            unmatched_reads += n_unmatched
             # Keep only pairs where both reads have good quality
-            if end1_passed and end2_passed:
-
-                # Flipping to get upper triangle
-                if (
-                    end1.reference_id == end2.reference_id
-                    and end1.reference_start > end2.reference_start
-                ) or end1.reference_id > end2.reference_id:
-                    end1, end2 = end2, end1
-                pairs_writer.writerow(
-                    [
-                        end1.query_name,
-                        end1.reference_name,
-                        end1.reference_start + 1,
-                        end2.reference_name,
-                        end2.reference_start + 1,
-                        "-" if end1.is_reverse else "+",
-                        "-" if end2.is_reverse else "+",
-                    ]
-                )
-    pairs.close()
+            matched = matched[
+                (matched.mapq1 >= min_qual) & (matched.mapq2 >= min_qual)
+            ]
+            # Flipping to get upper triangle
+            chrom1, chrom2 = matched.chrom1.values, matched.chrom2.values
+            pos1, pos2 = matched.pos1.values, matched.pos2.values
+            rev1, rev2 = matched.reverse1.values, matched.reverse2.values
+            flip = (chrom1 > chrom2) | ((chrom1 == chrom2) & (pos1 > pos2))
+            chrom1, chrom2 = (
+                np.where(flip, chrom2, chrom1),
+                np.where(flip, chrom1, chrom2),
+            )
+            pos1, pos2 = np.where(flip, pos2, pos1), np.where(flip, pos1, pos2)
+            rev1, rev2 = np.where(flip, rev2, rev1), np.where(flip, rev1, rev2)
+            batch_pairs = pd.DataFrame(
+                {
+                    "readID": matched.name.values,
+                    "chr1": chrom_names[chrom1],
+                    "pos1": pos1 + 1,
+                    "chr2": chrom_names[chrom2],
+                    "pos2": pos2 + 1,
+                    "strand1": np.where(rev1, "-", "+"),
+                    "strand2": np.where(rev2, "-", "+"),
+                }
+            )
+            if out_pairs is not None:
+                batch_pairs.to_csv(pairs, sep="\t", header=False, index=False)
+            if out_pairs_idx is None:
+                continue
+            # Pairs with unmapped reads or on contigs absent from
+            # info_contigs cannot be indexed
+            rank1, rank2 = chrom_ranks[chrom1], chrom_ranks[chrom2]
+            indexed = (rank1 >= 0) & (rank2 >= 0)
+            if not indexed.all():
+                for chrom, rank in ((chrom1, rank1), (chrom2, rank2)):
+                    missing_contigs.update(
+                        chrom_names[chrom[(rank < 0) & (chrom >= 0)]]
+                    )
+                batch_pairs = batch_pairs[indexed].copy()
+            batch_pairs["frag1"] = hcd.find_frags(
+                rank1[indexed], pos1[indexed], sites, offsets
+            )
+            batch_pairs["frag2"] = hcd.find_frags(
+                rank2[indexed], pos2[indexed], sites, offsets
+            )
+            batch_pairs.to_csv(idx_pairs, sep="\t", header=False, index=False)
+        # Reads still waiting for their mate do not have one
+        unmatched_reads += len(pending1) + len(pending2)
+    if missing_contigs:
+        logger.warning(
+            "Pairs on the following contigs were discarded from the "
+            "indexed pairs as those contigs are not listed in the "
+            "info_contigs file. This is normal if you filtered out small "
+            "contigs: %s" % " ".join(sorted(missing_contigs))
+        )
     if unmatched_reads > 0:
         logger.warning(
             "%d reads were only present in one BAM file. Make sure you sorted reads by name before running the pipeline.",
@@ -239,13 +447,20 @@ def bam2pairs(bam1, bam2, out_pairs, info_contigs, min_qual=30):
 
 def generate_log_header(log_path, input1, input2, genome, enzyme):
     hcl.set_file_handler(log_path, formatter=logging.Formatter(""))
-    logger.info("## hicstuff: v%s log file", __version__)
-    logger.info("## date: %s", time.strftime("%Y-%m-%d %H:%M:%S"))
-    logger.info("## enzyme: %s", str(enzyme))
-    logger.info("## input1: %s ", input1)
-    logger.info("## input2: %s", input2)
-    logger.info("## ref: %s", genome)
-    logger.info("---")
+    # The header is emitted as a single record
+    logger.info(
+        "\n".join(
+            [
+                "## hicstuff: v%s log file" % __version__,
+                "## date: %s" % time.strftime("%Y-%m-%d %H:%M:%S"),
+                "## enzyme: %s" % str(enzyme),
+                "## input1: %s " % input1,
+                "## input2: %s" % input2,
+                "## ref: %s" % genome,
+                "---",
+            ]
+        )
+    )
     hcl.set_file_handler(log_path, formatter=hcl.logfile_formatter)
 
 
@@ -272,35 +487,21 @@ def filter_pcr_dup(pairs_idx_file, filtered_file):
             filtered.write(head_line + "\n")
             next(pairs)
 
-        # Use csv methods to easily access columns
-        paircols = [
-            "readID",
-            "chr1",
-            "pos1",
-            "chr2",
-            "pos2",
-            "strand1",
-            "strand2",
-            "frag1",
-            "frag2",
-        ]
-        # Columns used for comparison of coordinates
-        coord_cols = [col for col in paircols if col != "readID"]
-        pair_reader = csv.DictReader(pairs, delimiter="\t", fieldnames=paircols)
-        filt_writer = csv.DictWriter(filtered, delimiter="\t", fieldnames=paircols)
-
-        # Initialise a variable to store coordinates of reads in previous pair
-        prev = {k: 0 for k in paircols}
-        for pair in pair_reader:
+        # Coordinates of the previous pair (all columns except readID)
+        prev_coords = None
+        for line in pairs:
             reads_count += 1
+            # Each line is split only once, and its coordinates are compared
+            # directly to those of the previous pair
+            coords = line.rstrip("\r\n").split("\t")[1:]
             # If coordinates are the same as before, skip pair
-            if all(pair[pair_var] == prev[pair_var] for pair_var in coord_cols):
+            if coords == prev_coords:
                 filter_count += 1
                 continue
             # Else write pair and store new coordinates as previous
             else:
-                filt_writer.writerow(pair)
-                prev = pair
+                filtered.write(line)
+                prev_coords = coords
         logger.info(
             "%d%% PCR duplicates have been filtered out (%d / %d pairs) "
             % (100 * round(filter_count / reads_count, 3), filter_count, reads_count)
@@ -333,6 +534,90 @@ def pairs2cool(pairs_file, cool_file, bins_file):
     os.remove(bins_tmp)
 
 
+def _iter_pairs_blocks(pairs_file, block_size=DEFAULT_PAIRS_BLOCK_SIZE):
+    """
+    Split the body of a pairs file into consecutive byte ranges of roughly
+    equal size, aligned on line boundaries.
+
+    Parameters
+    ----------
+    pairs_file : str
+        Path to the pairs file.
+    block_size : int
+        Approximate size of each block, in bytes.
+
+    Yields
+    ------
+    tuple of int :
+        Start (included) and end (excluded) byte offsets of each block.
+    """
+    with open(pairs_file, "rb") as pairs:
+        # Skip header lines
+        start = 0
+        line = pairs.readline()
+        while line.startswith(b"#"):
+            start = pairs.tell()
+            line = pairs.readline()
+        file_size = os.fstat(pairs.fileno()).st_size
+        while start < file_size:
+            # Extend the block to the end of the line it stops in
+            pairs.seek(start + block_size)
+            pairs.readline()
+            end = min(pairs.tell(), file_size)
+            yield start, end
+            start = end
+
+
+def _count_pairs_block(pairs_file, start, end):
+    """
+    Count the occurences of each fragment combination in a block of a pairs
+    file sorted by fragment indices.
+
+    Parameters
+    ----------
+    pairs_file : str
+        Path to the sorted pairs file, with only frag1 and frag2 columns.
+    start : int
+        Byte offset where the block starts, at the beginning of a line.
+    end : int
+        Byte offset where the block ends, after the end of a line.
+
+    Returns
+    -------
+    frag1 : numpy.array of int
+        First fragment of each distinct combination, in file order.
+    frag2 : numpy.array of int
+        Second fragment of each distinct combination, in file order.
+    n_occ : numpy.array of int
+        Number of consecutive pairs with each combination.
+    n_pairs : int
+        Number of pairs in the block.
+    """
+    with open(pairs_file, "rb") as pairs:
+        pairs.seek(start)
+        block = pairs.read(end - start)
+    try:
+        frags = pd.read_csv(
+            io.BytesIO(block),
+            sep="\t",
+            header=None,
+            names=["frag1", "frag2"],
+            dtype=np.int32,
+        )
+    except pd.errors.EmptyDataError:
+        frags = pd.DataFrame({"frag1": [], "frag2": []}, dtype=np.int32)
+    frag1, frag2 = frags.frag1.values, frags.frag2.values
+    # Pairs are sorted, so each fragment combination is a run of identical
+    # consecutive pairs.
+    run_starts = np.flatnonzero(
+        np.concatenate(
+            ([True], (frag1[1:] != frag1[:-1]) | (frag2[1:] != frag2[:-1]))
+        )
+    )
+    n_occ = np.diff(np.append(run_starts, len(frag1)))
+    return frag1[run_starts], frag2[run_starts], n_occ, len(frag1)
+
+
 def pairs2matrix(
     pairs_file, mat_file, fragments_file, mat_fmt="graal", threads=1, tmp_dir=None
 ):
@@ -356,32 +641,36 @@ def pairs2matrix(
         Temporary directory for sorting files. If None given, will use the system default.
     """
     # Number of fragments is N lines in frag list - 1 for the header
-    n_frags = sum(1 for line in open(fragments_file, "r")) - 1
+    n_frags = hio.count_lines(fragments_file) - 1
     frags = pd.read_csv(fragments_file, delimiter="\t")
 
-    def write_mat_entry(frag1, frag2, contacts):
-        """Write a single sparse matrix entry in either graal or bg2 format"""
+    def format_mat_entries(frag1, frag2, contacts):
+        """Format sparse matrix entries in either graal or bg2 format"""
         if mat_fmt == "graal":
-            mat.write("\t".join(map(str, [frag1, frag2, n_occ])) + "\n")
-        elif mat_fmt == "bg2":
-            frag1, frag2 = int(frag1), int(frag2)
-            mat.write(
-                "\t".join(
-                    map(
-                        str,
-                        [
-                            frags.chrom[frag1],
-                            frags.start_pos[frag1],
-                            frags.end_pos[frag1],
-                            frags.chrom[frag2],
-                            frags.start_pos[frag2],
-                            frags.end_pos[frag2],
-                            contacts,
-                        ],
-                    )
-                )
-                + "\n"
+            entries = io.StringIO()
+            np.savetxt(
+                entries,
+                np.column_stack((frag1, frag2, contacts)),
+                fmt="%d",
+                delimiter="\t",
             )
+            return entries.getvalue()
+        elif mat_fmt == "bg2":
+            return pd.DataFrame(
+                {
+                    "chrom1": frags.chrom.values[frag1],
+                    "start1": frags.start_pos.values[frag1],
+                    "end1": frags.end_pos.values[frag1],
+                    "chrom2": frags.chrom.values[frag2],
+                    "start2": frags.start_pos.values[frag2],
+                    "end2": frags.end_pos.values[frag2],
+                    "contacts": contacts,
+                }
+            ).to_csv(sep="\t", header=False, index=False)
+
+    def format_mat_entry(entry):
+        """Format a single (frag1, frag2, contacts) matrix entry"""
+        return format_mat_entries(*[[value] for value in entry])
 
     pre_mat_file = mat_file + ".pre.pairs"
     hio.sort_pairs(
@@ -390,51 +679,82 @@ def pairs2matrix(
         keys=["frag1", "frag2"],
         threads=threads,
         tmp_dir=tmp_dir,
+        columns=["frag1", "frag2"],
     )
-    header_size = len(hio.get_pairs_header(pre_mat_file))
-    with open(pre_mat_file, "r") as pairs, open(mat_file, "w") as mat:
-        # Skip header lines
-        for _ in range(header_size):
-            next(pairs)
-        prev_pair = ["0", "0"]  # Pairs identified by [frag1, frag2]
-        n_occ = 0  # Number of occurences of each frag combination
-        n_nonzero = 0  # Total number of nonzero matrix entries
-        n_pairs = 0  # Total number of pairs entered in the matrix
-        pairs_reader = csv.reader(pairs, delimiter="\t")
-        # First line contains nrows, ncols and number of nonzero entries.
-        # Number of nonzero entries is unknown for now
-        if mat_fmt == "graal":
-            mat.write("\t".join(map(str, [n_frags, n_frags, "-"])) + "\n")
-        for pair in pairs_reader:
-            # Fragment ids are field 8 and 9
-            curr_pair = [pair[7], pair[8]]
-            # Increment number of occurences for fragment pair
-            if prev_pair == curr_pair:
-                n_occ += 1
-            # Write previous pair and start a new one
+    n_nonzero = 0  # Total number of nonzero matrix entries
+    n_pairs = 0  # Total number of pairs entered in the matrix
+    # Last fragment pair of the previous block, which may continue in the next
+    last_entry = None
+
+    def count_block(start, end):
+        """Count pairs of a block and format its matrix entries"""
+        frag1, frag2, n_occ, n_block_pairs = _count_pairs_block(
+            pre_mat_file, start, end
+        )
+        # Runs at both ends of the block may continue in the neighbouring
+        # blocks, they are merged and formatted by the main thread.
+        inner_entries = format_mat_entries(
+            frag1[1:-1], frag2[1:-1], n_occ[1:-1]
+        )
+        return frag1, frag2, n_occ, n_block_pairs, inner_entries
+
+    def merge_block(frag1, frag2, n_occ, n_block_pairs, inner_entries):
+        """Write the entries of a block, merging runs split between blocks"""
+        nonlocal n_nonzero, n_pairs, last_entry
+        n_pairs += n_block_pairs
+        if not len(n_occ):
+            return
+        first_entry = (frag1[0], frag2[0], n_occ[0])
+        if last_entry is not None:
+            if first_entry[:2] == last_entry[:2]:
+                first_entry = first_entry[:2] + (
+                    first_entry[2] + last_entry[2],
+                )
             else:
-                if n_occ > 0:
-                    write_mat_entry(prev_pair[0], prev_pair[1], n_occ)
-                prev_pair = curr_pair
-                n_pairs += n_occ
-                n_occ = 1
+                mat.write(format_mat_entry(last_entry))
                 n_nonzero += 1
+        if len(n_occ) == 1:
+            last_entry = first_entry
+            return
+        mat.write(format_mat_entry(first_entry))
+        mat.write(inner_entries)
+        n_nonzero += len(n_occ) - 1
+        # The last run may continue in the next block
+        last_entry = (frag1[-1], frag2[-1], n_occ[-1])
+
+    with open(mat_file, "w") as mat:
+        # First line contains nrows, ncols and number of nonzero entries.
+        # Number of nonzero entries is unknown for now: reserve a zero-padded
+        # slot wide enough for any count so it can be filled in place later.
+        if mat_fmt == "graal":
+            header_prefix = "%d\t%d\t" % (n_frags, n_frags)
+            nnz_width = len(str(n_frags * n_frags))
+            mat.write(header_prefix + "0" * nnz_width + "\n")
+        # Blocks are parsed, counted and formatted by the workers while the
+        # main thread writes their entries in order, with at most two blocks
+        # per worker in memory.
+        pool = ThreadPoolExecutor(max_workers=threads)
+        pending = collections.deque()
+        try:
+            for start, end in _iter_pairs_blocks(pre_mat_file):
+                pending.append(pool.submit(count_block, start, end))
+                if len(pending) >= 2 * threads:
+                    merge_block(*pending.popleft().result())
+            while pending:
+                merge_block(*pending.popleft().result())
+        finally:
+            pool.shutdown()
         # Write the last value
-        write_mat_entry(curr_pair[0], curr_pair[1], n_occ)
-        n_nonzero += 1
-        n_pairs += 1
+        if last_entry is not None:
+            mat.write(format_mat_entry(last_entry))
+            n_nonzero += 1
 
-    # Edit header line to fill number of nonzero entries inplace in graal header
+    # Fill number of nonzero entries inplace in graal header
     if mat_fmt == "graal":
-        with open(mat_file) as mat, open(pre_mat_file, "w") as tmp_mat:
-            header = mat.readline()
-            header = header.replace("-", str(n_nonzero))
-            tmp_mat.write(header)
-            st.copyfileobj(mat, tmp_mat)
-        # Replace the matrix file with the one with corrected header
-        os.rename(pre_mat_file, mat_file)
-    else:
-        os.remove(pre_mat_file)
+        with open(mat_file, "r+") as mat:
+            mat.seek(len(header_prefix))
+            mat.write("%0*d" % (nnz_width, n_nonzero))
+    os.remove(pre_mat_file)
 
     logger.info(
         "%d pairs used to build a contact map of %d bins with %d nonzero entries.",
@@ -475,6 +795,7 @@ def full_pipeline(
     start_stage="fastq",
     threads=1,
     tmp_dir=None,
+    parallel_align=False,
 ):
     """
     Run the whole hicstuff pipeline. Starting from fastq files and a genome to
@@ -554,6 +875,10 @@ def full_pipeline(
     remove_centros : None or int
         If the distance law is computed, this is the number of kb that will be removed
         around the centromere position given by in the centromere file.
+    parallel_align : bool
+        If True, forward and reverse reads are aligned at the same time, each
+        with half of the threads. This requires twice the memory of the
+        aligner, since each alignment loads its own copy of the genome index.
     """
     # Check if third parties can be run
     if aligner in ("bowtie2", "minimap2", "bwa"):
@@ -644,8 +969,12 @@ def full_pipeline(
     # Define temporary file names
     log_file = _out_file("hicstuff_" + now + ".log")
     tmp_genome = _tmp_file("genome.fasta")
+    tmp_mm2_index = _tmp_file("genome.mmi")
     bam1 = _tmp_file("for.bam")
     bam2 = _tmp_file("rev.bam")
+    # Input of the fragment attribution when starting from pairs. When
+    # starting from reads or BAM files, pairs are indexed directly and this
+    # file is only written to be kept with no_cleanup.
     pairs = _tmp_file("valid.pairs")
     pairs_idx = _tmp_file("valid_idx.pairs")
     pairs_filtered = _tmp_file("valid_idx_filtered.pairs")
@@ -720,6 +1049,16 @@ def full_pipeline(
             )
             sp.run(index_cmd, stderr=sp.PIPE)
 
+    # minimap2 indexes a fasta genome on each call. Build its index once
+    # instead, and share it between the alignments of both ends.
+    if aligner == "minimap2" and start_stage == 0:
+        sp.run(
+            ["minimap2", "-x", "sr", "-d", tmp_mm2_index, genome],
+            stderr=sp.PIPE,
+            check=True,
+        )
+        genome = tmp_mm2_index
+
     # Check for spaces in fasta headers and issue error if found
     for record in SeqIO.parse(fasta, "fasta"):
         if " " in record.id:
@@ -756,58 +1095,76 @@ def full_pipeline(
         enzyme = enzyme.split(",")
     # Perform genome alignment
     if start_stage == 0:
-        align_reads(
-            reads1,
-            genome,
-            bam1,
-            tmp_dir=tmp_dir,
-            threads=threads,
-            aligner=aligner,
-            iterative=iterative,
-            min_qual=min_qual,
-            read_len=read_len,
-        )
-        align_reads(
-            reads2,
-            genome,
-            bam2,
+        align_args = dict(
             tmp_dir=tmp_dir,
-            threads=threads,
             aligner=aligner,
             iterative=iterative,
             min_qual=min_qual,
             read_len=read_len,
         )
+        if parallel_align:
+            # Both ends are aligned concurrently, sharing the available
+            # threads. The work happens in subprocesses, so python threads
+            # are enough.
+            end_threads = [max(1, threads // 2), max(1, threads - threads // 2)]
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                alignments = [
+                    executor.submit(
+                        align_reads,
+                        reads,
+                        genome,
+                        bam,
+                        threads=end_threads[i],
+                        **align_args
+                    )
+                    for i, (reads, bam) in enumerate(
+                        [(reads1, bam1), (reads2, bam2)]
+                    )
+                ]
+                # Propagate errors from either alignment
+                for alignment in alignments:
+                    alignment.result()
+        else:
+            align_reads(reads1, genome, bam1, threads=threads, **align_args)
+            align_reads(reads2, genome, bam2, threads=threads, **align_args)
 
-    # Starting from bam files
-    if start_stage <= 1:
+    # Starting from bam or pairs files
+    if start_stage <= 2:
 
         fragments_updated = True
-        # Generate info_contigs and fragments_list output files
-        hcd.write_frag_info(
+        # Generate info_contigs and fragments_list output files. Restriction
+        # tables computed along the way are reused to index pairs.
+        restrict_table = hcd.write_frag_info(
             fasta,
             enzyme,
             min_size=min_size,
             circular=circular,
             output_contigs=info_contigs,
             output_frags=fragments_list,
+            threads=threads,
         )
 
+    # Starting from bam files
+    if start_stage <= 1:
+
         # Log fragment size distribution
         hcd.frag_len(frags_file_name=fragments_list, plot=plot, fig_path=frag_plot)
 
-        # Make pairs file (readID, chr1, chr2, pos1, pos2, strand1, strand2)
-        bam2pairs(bam1, bam2, pairs, info_contigs, min_qual=min_qual)
+        # Make pairs with fragment index (readID, chr1, pos1, chr2, pos2,
+        # strand1, strand2, frag1, frag2) in a single pass. The pairs file
+        # without index is only needed if temporary files are kept.
+        bam2pairs(
+            bam1,
+            bam2,
+            pairs if no_cleanup else None,
+            info_contigs,
+            min_qual=min_qual,
+            restriction_table=restrict_table,
+            out_pairs_idx=pairs_idx,
+        )
 
     # Starting from pairs file
-    if start_stage <= 2:
-        restrict_table = {}
-        for record in SeqIO.parse(fasta, "fasta"):
-            # Get chromosome restriction table
-            restrict_table[record.id] = hcd.get_restriction_table(
-                record.seq, enzyme, circular=circular
-            )
-
+    elif start_stage == 2:
         # Add fragment index to pairs (readID, chr1, pos1, chr2,
         # pos2, strand1, strand2, frag1, frag2)
         hcd.attribute_fragments(pairs, pairs_idx, restrict_table)
@@ -848,6 +1205,7 @@ def full_pipeline(
             circular=circular,
             output_contigs=info_contigs,
             output_frags=fragments_list,
+            threads=threads,
         )
 
     # Generate distance law table if enabled
@@ -864,6 +1222,8 @@ def full_pipeline(
             out_file=out_distance_law,
             circular=circular,
             rm_centro=remove_centros,
+            threads=threads,
+            cache=False,
         )
         # Generate distance law figure is plots are enabled
         if plot:
@@ -905,6 +1265,7 @@ def full_pipeline(
             bam2,
             pairs_pcr,
             tmp_genome,
+            tmp_mm2_index,
         ]
         # Do not delete files that were given as input
         try:
@@ -17,18 +17,20 @@ def test_write_frag_info():
     genome.write(seq)
     genome.close()
     out_dir, tigs, frags = "test_data", "test_tigs", "test_frags"
-    hcd.write_frag_info(
+    restriction_table = hcd.write_frag_info(
         genome.name,
         "DpnII",
         output_contigs=tigs,
         output_frags=frags,
         output_dir=out_dir,
+        cache=False,
     )
     tigs_df = pd.read_csv(join(out_dir, tigs), delimiter="\t")
     frags_df = pd.read_csv(join(out_dir, frags), delimiter="\t")
 
     assert tigs_df.length.tolist()[0] == len(seq)
     assert frags_df.start_pos.tolist() == [0, 6, 14, 22]
+    assert list(restriction_table["seq1"]) == [0, 6, 14, 22, len(seq)]
 
     os.unlink(genome.name)
     os.remove(join(out_dir, tigs))
@@ -50,3 +52,87 @@ def test_attribute_fragments():
     )
 
     assert filecmp.cmp("test_data/valid_idx.pairs", idx_pairs.name)
+
+    # Pairs on contigs without restriction table (e.g. filtered out by size)
+    # are discarded, other pairs keep the same fragments
+    del restriction_table["seq2"]
+    hcd.attribute_fragments(
+        "test_data/valid.pairs", idx_pairs.name, restriction_table
+    )
+    cols = ["readID", "chr1", "pos1", "chr2", "pos2", "strand1", "strand2"]
+    cols += ["frag1", "frag2"]
+    exp_pairs = pd.read_csv(
+        "test_data/valid_idx.pairs", sep="\t", comment="#", names=cols
+    )
+    exp_pairs = exp_pairs[(exp_pairs.chr1 == "seq1") & (exp_pairs.chr2 == "seq1")]
+    obs_pairs = pd.read_csv(idx_pairs.name, sep="\t", comment="#", names=cols)
+    assert obs_pairs.equals(exp_pairs.reset_index(drop=True))
+    os.unlink(idx_pairs.name)
+
+
+def test_find_frags():
+    """Test the vectorized attribution of positions to restriction fragments"""
+    restriction_table = {}
+    for record in SeqIO.parse("test_data/genome/seq.fa", "fasta"):
+        restriction_table[record.id] = hcd.get_restriction_table(
+            record.seq, "DpnII"
+        )
+    sites, offsets = hcd.flatten_restriction_table(
+        restriction_table, ["seq1", "seq2"]
+    )
+    pairs = pd.read_csv(
+        "test_data/valid_idx.pairs",
+        sep="\t",
+        comment="#",
+        header=None,
+        names=["readID", "chr1", "pos1", "chr2", "pos2", "strand1",
+               "strand2", "frag1", "frag2"],
+    )
+    for end in ("1", "2"):
+        ranks = pairs["chr" + end].map({"seq1": 0, "seq2": 1}).values
+        frags = hcd.find_frags(
+            ranks, pairs["pos" + end].values - 1, sites, offsets
+        )
+        assert (frags == pairs["frag" + end].values).all()
+
+
+def test_digest_cache(monkeypatch, tmp_path):
+    """Test reuse of cached restriction tables between digestions"""
+    # Keep the cache out of the user cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    out_dir = "test_data"
+    genome = "test_data/genome/seq.fa"
+    cache_path = hcd._digest_cache_path(genome, "DpnII")
+    assert cache_path.startswith(str(tmp_path))
+    try:
+        hcd.write_frag_info(
+            genome,
+            "DpnII",
+            output_contigs="test_tigs",
+            output_frags="test_frags_nocache",
+            output_dir=out_dir,
+            cache=True,
+        )
+        assert os.path.exists(cache_path)
+        cached = hcd._load_digest_cache(cache_path)
+        for record in SeqIO.parse(genome, "fasta"):
+            assert (
+                cached[record.id]
+                == hcd.get_restriction_table(record.seq, "DpnII")
+            ).all()
+        hcd.write_frag_info(
+            genome,
+            "DpnII",
+            output_contigs="test_tigs",
+            output_frags="test_frags_cache",
+            output_dir=out_dir,
+            cache=True,
+        )
+        assert filecmp.cmp(
+            join(out_dir, "test_frags_nocache"),
+            join(out_dir, "test_frags_cache"),
+        )
+    finally:
+        os.remove(join(out_dir, "test_frags_nocache"))
+        os.remove(join(out_dir, "test_frags_cache"))
+        os.remove(join(out_dir, "test_tigs"))
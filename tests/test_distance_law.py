@@ -142,6 +142,36 @@ def test_get_distance_law():
     os.unlink(distance_law.name)
 
 
+def test_get_distance_law_cache(monkeypatch, tmp_path):
+    """Test that the binary cache of pairs gives the same distance law."""
+    # Keep the cache out of the user cache directory
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache_path = hcdl._pairs_cache_path(pairs_reads_file)
+    distance_law = NamedTemporaryFile("w", delete=False)
+    try:
+        # Without cache, nothing is written
+        hcdl.get_distance_law(
+            pairs_reads_file, fragments_file, out_file=distance_law.name
+        )
+        assert not os.path.exists(cache_path)
+        # First run writes the cache, second run reads it
+        for _ in range(2):
+            hcdl.get_distance_law(
+                pairs_reads_file,
+                fragments_file,
+                out_file=distance_law.name,
+                cache=True,
+            )
+            assert os.path.exists(cache_path)
+            assert hash_file(distance_law.name) == hash_file(distance_law_file)
+        # Only the cache file is left in the cache directory
+        assert os.listdir(os.path.dirname(cache_path)) == [
+            os.path.basename(cache_path)
+        ]
+    finally:
+        os.unlink(distance_law.name)
+
+
 def test_normalize_distance_law():
     """Test function making the average of distance law."""
     # Test normal conditions.
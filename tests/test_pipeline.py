@@ -1,19 +1,170 @@
 # Test functions for the pipeline submodule
 
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
 import os, shutil
+import functools
 import pandas as pd
 import filecmp
 import numpy as np
+import pysam as ps
+import hicstuff.digest as hcd
 import hicstuff.pipeline as hpi
 
 
+def write_test_bam(bam_file, reads, refs):
+    """Write name-sorted alignments given as (name, chrom, pos, reverse,
+    mapq) tuples, with chrom -1 for unmapped reads."""
+    header = {
+        "HD": {"VN": "1.0", "SO": "queryname"},
+        "SQ": [{"SN": name, "LN": length} for name, length in refs],
+    }
+    with ps.AlignmentFile(bam_file, "wb", header=header) as bam:
+        for name, chrom, pos, reverse, mapq in reads:
+            aln = ps.AlignedSegment(bam.header)
+            aln.query_name = name
+            aln.query_sequence = "A" * 20
+            if chrom < 0:
+                aln.flag = 4
+            else:
+                aln.flag = 16 if reverse else 0
+                aln.reference_id = chrom
+                aln.reference_start = pos
+                aln.cigarstring = "20M"
+                aln.mapping_quality = mapq
+            bam.write(aln)
+
+
 def test_sam2pairs():
-    ...
+    """Test that mates split between batches of alignments are matched"""
+    tmp_dir = mkdtemp()
+    genome = "test_data/genome/seq.fa"
+    info_contigs = os.path.join(tmp_dir, "info_contigs.txt")
+    restrict_table = hcd.write_frag_info(
+        genome,
+        "DpnII",
+        output_contigs=info_contigs,
+        output_frags=os.path.join(tmp_dir, "fragments_list.txt"),
+    )
+    refs = [("seq1", 60000), ("seq2", 20000)]
+    rng = np.random.RandomState(42)
+    # Each end misses some reads and has secondary alignments for others, so
+    # that unmatched reads end up on both sides of batch boundaries.
+    names = ["read%04d" % i for i in range(300)]
+    ends = []
+    for end in range(2):
+        reads = []
+        for name in names:
+            if rng.rand() < 0.1:
+                continue
+            for _ in range(1 + (rng.rand() < 0.1)):
+                mapped = rng.rand() > 0.05
+                reads.append(
+                    (
+                        name,
+                        rng.randint(2) if mapped else -1,
+                        rng.randint(19000),
+                        bool(rng.randint(2)),
+                        rng.choice([10, 40]) if mapped else 0,
+                    )
+                )
+        ends.append(reads)
+    bams = []
+    for end, reads in enumerate(ends):
+        bams.append(os.path.join(tmp_dir, "end%d.bam" % end))
+        write_test_bam(bams[-1], reads, refs)
+    # Expected pairs use the first alignment of each read
+    first = [{}, {}]
+    for end, reads in enumerate(ends):
+        for read in reads:
+            first[end].setdefault(read[0], read)
+    exp_reads = [
+        name
+        for name in names
+        if name in first[0]
+        and name in first[1]
+        and first[0][name][4] >= 30
+        and first[1][name][4] >= 30
+    ]
+    iter_bam_batches = hpi._iter_bam_batches
+    outputs = []
+    try:
+        for batch_size in (hpi.DEFAULT_BAM_BATCH_SIZE, 7, 1):
+            hpi._iter_bam_batches = functools.partial(
+                iter_bam_batches, batch_size=batch_size
+            )
+            out_pairs = os.path.join(tmp_dir, "%d.pairs" % batch_size)
+            hpi.bam2pairs(
+                bams[0],
+                bams[1],
+                out_pairs,
+                info_contigs,
+                restriction_table=restrict_table,
+                out_pairs_idx=out_pairs + ".idx",
+            )
+            outputs.append(out_pairs)
+    finally:
+        hpi._iter_bam_batches = iter_bam_batches
+    pairs = pd.read_csv(outputs[0], sep="\t", comment="#", header=None)
+    assert pairs[0].tolist() == exp_reads
+    for out_pairs in outputs[1:]:
+        assert filecmp.cmp(outputs[0], out_pairs, shallow=False)
+        assert filecmp.cmp(
+            outputs[0] + ".idx", out_pairs + ".idx", shallow=False
+        )
+    # Indexed pairs can be written alone
+    out_pairs_idx = os.path.join(tmp_dir, "idx_only.pairs")
+    hpi.bam2pairs(
+        bams[0],
+        bams[1],
+        None,
+        info_contigs,
+        restriction_table=restrict_table,
+        out_pairs_idx=out_pairs_idx,
+    )
+    assert filecmp.cmp(outputs[0] + ".idx", out_pairs_idx, shallow=False)
+    shutil.rmtree(tmp_dir)
 
 
 def test_pairs2mat():
-    ...
+    """Test that counts of fragment pairs split between blocks are merged"""
+    tmp_dir = mkdtemp()
+    fragments_file = "test_data/fragments_list.txt"
+    iter_pairs_blocks = hpi._iter_pairs_blocks
+    for mat_fmt in ("graal", "bg2"):
+        outputs = []
+        try:
+            # Tiny blocks split most runs of identical fragment pairs
+            for block_size, threads in (
+                (hpi.DEFAULT_PAIRS_BLOCK_SIZE, 1),
+                (24, 1),
+                (50, 3),
+            ):
+                hpi._iter_pairs_blocks = functools.partial(
+                    iter_pairs_blocks, block_size=block_size
+                )
+                mat_file = os.path.join(
+                    tmp_dir, "%s_%d_%d.mat" % (mat_fmt, block_size, threads)
+                )
+                hpi.pairs2matrix(
+                    "test_data/valid_idx.pairs",
+                    mat_file,
+                    fragments_file,
+                    mat_fmt=mat_fmt,
+                    threads=threads,
+                    tmp_dir=tmp_dir,
+                )
+                outputs.append(mat_file)
+        finally:
+            hpi._iter_pairs_blocks = iter_pairs_blocks
+        for mat_file in outputs[1:]:
+            assert filecmp.cmp(outputs[0], mat_file, shallow=False)
+    # All pairs are counted once in the matrix
+    mat = pd.read_csv(outputs[0], sep="\t", header=None)
+    n_pairs = sum(
+        1 for line in open("test_data/valid_idx.pairs") if line[0] != "#"
+    )
+    assert mat[6].sum() == n_pairs
+    shutil.rmtree(tmp_dir)
 
 
 def test_filter_pcr_dup():